@@ -1,17 +1,19 @@
 import streamlit as st
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import asyncio
 import telegram
+from telegram.request import HTTPXRequest
 import time
-import schedule
 import threading
 import uuid
-from datetime import datetime
 import pytz
-from dateutil.parser import parse
 import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # Set timezone to IST
 ist = pytz.timezone('Asia/Kolkata')
@@ -21,7 +23,15 @@ def init_db():
     conn = sqlite3.connect('stock_alerts.db')
     c = conn.cursor()
     
+    # WAL lets the scheduler thread write while the UI thread reads
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA busy_timeout=5000")
+    c.execute("PRAGMA temp_store=MEMORY")
+    c.execute("PRAGMA cache_size=-20000")
+    
     # Create stocks table with unique constraint on id and added_time column
+    # (timestamps are INTEGER epoch milliseconds)
     c.execute('''CREATE TABLE IF NOT EXISTS stocks
                  (id TEXT PRIMARY KEY, 
                   symbol TEXT, 
@@ -33,26 +43,60 @@ def init_db():
                   last_notified_target REAL,
                   last_notified_pre_alert REAL, 
                   last_notified_pre_target REAL,
-                  alert_trigger_time TEXT,
-                  target_trigger_time TEXT,
+                  alert_trigger_time INTEGER,
+                  target_trigger_time INTEGER,
                   status TEXT,
-                  added_time TEXT)''')
+                  added_time INTEGER)''')
     
     # Check if the new columns exist and add them if they don't
     c.execute("PRAGMA table_info(stocks)")
     columns = [info[1] for info in c.fetchall()]
     
     if 'alert_trigger_time' not in columns:
-        c.execute("ALTER TABLE stocks ADD COLUMN alert_trigger_time TEXT")
+        c.execute("ALTER TABLE stocks ADD COLUMN alert_trigger_time INTEGER")
     
     if 'target_trigger_time' not in columns:
-        c.execute("ALTER TABLE stocks ADD COLUMN target_trigger_time TEXT")
+        c.execute("ALTER TABLE stocks ADD COLUMN target_trigger_time INTEGER")
     
     if 'status' not in columns:
         c.execute("ALTER TABLE stocks ADD COLUMN status TEXT DEFAULT 'Open'")
     
     if 'added_time' not in columns:
-        c.execute("ALTER TABLE stocks ADD COLUMN added_time TEXT")
+        c.execute("ALTER TABLE stocks ADD COLUMN added_time INTEGER")
+    
+    # Older databases store the timestamps as ISO text; SQLite can't change a column's
+    # type in place, so rebuild the table (keeping every other column and index)
+    # with the timestamps converted to epoch ms
+    time_columns = ('alert_trigger_time', 'target_trigger_time', 'added_time')
+    c.execute("PRAGMA table_info(stocks)")
+    table_info = c.fetchall()
+    if any(name in time_columns and col_type == 'TEXT' for _, name, col_type, _, _, _ in table_info):
+        definitions, selects = [], []
+        for _, name, col_type, notnull, default, pk in table_info:
+            if name in time_columns:
+                definitions.append(f"{name} INTEGER")
+                selects.append(f"CAST(ROUND((julianday({name}) - 2440587.5) * 86400000) AS INTEGER)")
+            else:
+                definitions.append(f"{name} {col_type}" + (" PRIMARY KEY" if pk else "") + (" NOT NULL" if notnull else "") +
+                                   (f" DEFAULT {default}" if default is not None else ""))
+                selects.append(name)
+        c.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'stocks' AND sql IS NOT NULL")
+        indexes = [row[0] for row in c.fetchall()]
+        # One transaction for the whole rebuild (SQLite DDL is transactional), so a failure
+        # leaves the original table in place; the DROP clears a leftover from older runs
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute("DROP TABLE IF EXISTS stocks_migrated")
+            c.execute(f"CREATE TABLE stocks_migrated ({', '.join(definitions)})")
+            c.execute(f"INSERT INTO stocks_migrated SELECT {', '.join(selects)} FROM stocks")
+            c.execute("DROP TABLE stocks")
+            c.execute("ALTER TABLE stocks_migrated RENAME TO stocks")
+            for index_sql in indexes:
+                c.execute(index_sql)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
     
     # Create strategies table if it doesn't exist
     c.execute('''CREATE TABLE IF NOT EXISTS strategies
@@ -61,16 +105,33 @@ def init_db():
     # Ensure no duplicate IDs in stocks table
     c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_stocks_id ON stocks(id)")
     
+    # Partial index for the scheduler's enabled-only scan
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stocks_enabled ON stocks(enabled) WHERE enabled = 1")
+    
     conn.commit()
     conn.close()
 
 # Initialize database
 init_db()
 
+# One autocommit connection per thread (Streamlit script threads + scheduler thread); the
+# thread-local lives in st.cache_resource because module globals are rebuilt on every rerun
+@st.cache_resource
+def get_thread_conns():
+    return threading.local()
+
+def get_conn():
+    tls = get_thread_conns()
+    if not hasattr(tls, 'conn'):
+        tls.conn = sqlite3.connect('stock_alerts.db', check_same_thread=False, isolation_level=None)
+        tls.conn.execute("PRAGMA busy_timeout=5000")
+    return tls.conn
+
 # Telegram bot setup
 TELEGRAM_TOKEN = st.secrets["TELEGRAM_TOKEN"]
 CHAT_ID = st.secrets["CHAT_ID"]
-bot = telegram.Bot(token=TELEGRAM_TOKEN)
+# Pooled HTTP/2 client; kept open by the notifier loop so TLS sessions are reused
+bot = telegram.Bot(token=TELEGRAM_TOKEN, request=HTTPXRequest(connection_pool_size=8, http_version="2"))
 
 # NSE headers
 headers = {
@@ -78,21 +139,34 @@ headers = {
     "Accept": "application/json, text/plain, */*",
     "Accept-Language": "en-US,en;q=0.9",
     "Referer": "https://www.nseindia.com/market-data/equity-derivatives-watch",
+    "Accept-Encoding": "gzip, deflate",
 }
 
+# urllib3 only decodes brotli bodies when the brotli package is installed
+try:
+    import brotli  # noqa: F401
+    headers["Accept-Encoding"] = "gzip, deflate, br"
+except ImportError:
+    pass
+
 # Initialize NSE session
 nse_session = None
 def initialize_nse_session():
     global nse_session
     if nse_session is None:
         nse_session = requests.Session()
+        # Pool sized above the fetch thread pool so concurrent quotes reuse connections
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32,
+                              max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]))
+        nse_session.mount("https://", adapter)
+        nse_session.headers.update(headers)
         try:
-            response = nse_session.get("https://www.nseindia.com/", headers=headers)
+            response = nse_session.get("https://www.nseindia.com/")
             if response.status_code != 200:
                 st.warning(f"Failed to load NSE homepage: {response.status_code}")
                 return False
             time.sleep(2)
-            response = nse_session.get("https://www.nseindia.com/market-data/equity-derivatives-watch", headers=headers)
+            response = nse_session.get("https://www.nseindia.com/market-data/equity-derivatives-watch")
             time.sleep(2)
             if response.status_code != 200:
                 st.warning(f"Failed to load NSE derivatives page: {response.status_code}")
@@ -103,16 +177,13 @@ def initialize_nse_session():
     return True
 
 # Function to fetch current price from NSE
-def get_current_price_nse(ticker):
+def _fetch_price_nse(ticker):
     global nse_session
-    if not isinstance(ticker, str) or pd.isna(ticker):
-        return None
     try:
-        ticker = ticker.upper().replace(".NS", "")
         if nse_session is None and not initialize_nse_session():
             return None
         quote_url = f"https://www.nseindia.com/api/quote-equity?symbol={ticker}"
-        response = nse_session.get(quote_url, headers=headers)
+        response = nse_session.get(quote_url)
         if response.status_code == 200:
             quote_data = response.json()
             last_price = quote_data.get('priceInfo', {}).get('lastPrice', 0)
@@ -128,6 +199,50 @@ def get_current_price_nse(ticker):
         st.warning(f"Error fetching NSE price for {ticker}: {e}")
         return None
 
+# Quotes are cached per 30s bucket so reruns and the scheduler share one fetch
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_price(ticker, bucket):
+    return _fetch_price_nse(ticker)
+
+def get_current_price_nse(ticker):
+    if not isinstance(ticker, str) or pd.isna(ticker):
+        return None
+    return _cached_price(ticker.upper().replace(".NS", ""), int(time.time() // 30))
+
+# Bulk snapshot of NIFTY 500 last prices keyed by NSE symbol, shared for 15s
+@st.cache_data(ttl=15, show_spinner=False)
+def fetch_all_prices_bulk():
+    if nse_session is None and not initialize_nse_session():
+        return {}
+    try:
+        response = nse_session.get("https://www.nseindia.com/api/equity-stockIndices?index=NIFTY%20500")
+        if response.status_code != 200:
+            st.warning(f"Failed to fetch NSE snapshot: HTTP {response.status_code}")
+            return {}
+        return {item['symbol'].upper(): item['lastPrice'] for item in response.json().get('data', [])
+                if isinstance(item.get('lastPrice'), (int, float)) and item['lastPrice'] > 0}
+    except Exception as e:
+        st.warning(f"Error fetching NSE snapshot: {e}")
+        return {}
+
+# One quote pool per process; a module-level pool would be rebuilt, and leaked, on every rerun
+@st.cache_resource
+def get_price_pool():
+    return ThreadPoolExecutor(max_workers=16)
+
+# Fetch prices for many symbols; returns {symbol: price}
+def get_current_prices_nse(tickers):
+    # Warm the session up front so the workers don't race to initialize it
+    if nse_session is None and not initialize_nse_session():
+        return {}
+    symbols = list(dict.fromkeys(t for t in tickers if isinstance(t, str) and t.strip()))
+    snapshot = fetch_all_prices_bulk()
+    prices = {t: snapshot.get(t.upper().replace(".NS", "")) for t in symbols}
+    # Fall back to concurrent per-symbol quotes for anything outside the snapshot
+    missing = [t for t, price in prices.items() if price is None]
+    prices.update(zip(missing, get_price_pool().map(get_current_price_nse, missing)))
+    return prices
+
 # Streamlit app
 st.set_page_config(page_title="Stock Alert System", layout="wide")
 st.markdown("""
@@ -150,25 +265,65 @@ st.sidebar.header("Configuration")
 check_interval = st.sidebar.slider("Price Check Interval (minutes)", 1, 60, 5)
 
 # Strategy management
+def _load_strategies():
+    return [row[0] for row in get_conn().execute("SELECT name FROM strategies").fetchall()]
+
+# Strategies only change via the sidebar, so keep them in session state across reruns
+if 'strategies' not in st.session_state:
+    st.session_state.strategies = _load_strategies()
+
 st.sidebar.subheader("Manage Strategies")
 new_strategy = st.sidebar.text_input("Add New Strategy")
 if st.sidebar.button("Add Strategy"):
     if new_strategy:
-        conn = sqlite3.connect('stock_alerts.db')
+        conn = get_conn()
         c = conn.cursor()
         c.execute("INSERT INTO strategies (id, name) VALUES (?, ?)", (str(uuid.uuid4()), new_strategy))
-        conn.commit()
-        conn.close()
+        st.session_state.strategies.append(new_strategy)
         st.sidebar.success(f"Strategy '{new_strategy}' added!")
 
 # Load strategies
-conn = sqlite3.connect('stock_alerts.db')
-c = conn.cursor()
-c.execute("SELECT name FROM strategies")
-strategies = [row[0] for row in c.fetchall()]
-conn.close()
-if not strategies:
-    strategies = ["Buy", "Sell", "Hold"]
+strategies = st.session_state.strategies or ["Buy", "Sell", "Hold"]
+
+# Explicit dtypes so numeric columns load straight into numpy arrays (NULL -> NaN)
+# instead of object columns of Python floats and None; a NULL enabled reads as disabled
+STOCK_DTYPES = {
+    'alert_price': 'float64', 'target_price': 'float64', 'enabled': 'int8',
+    'last_notified_alert': 'float64', 'last_notified_target': 'float64',
+    'last_notified_pre_alert': 'float64', 'last_notified_pre_target': 'float64',
+    'alert_trigger_time': 'float64', 'target_trigger_time': 'float64', 'added_time': 'float64',
+}
+
+# The stocks grid is held per session and patched from each UI write's RETURNING rows,
+# so adds/edits/deletes don't re-read the table; a full reload after STOCKS_TTL picks
+# up the scheduler's own writes
+STOCKS_TTL = 60
+
+def apply_stock_dtypes(df):
+    if 'enabled' in df.columns:
+        df = df.fillna({'enabled': 0})
+    return df.astype({col: STOCK_DTYPES[col] for col in df.columns if col in STOCK_DTYPES})
+
+def load_stocks():
+    if 'stocks_df' not in st.session_state or time.monotonic() - st.session_state.stocks_loaded > STOCKS_TTL:
+        st.session_state.stocks_df = apply_stock_dtypes(pd.read_sql_query("SELECT * FROM stocks", get_conn()))
+        st.session_state.stocks_loaded = time.monotonic()
+    return st.session_state.stocks_df
+
+def apply_returned_rows(cursor):
+    # Merge rows from INSERT/UPDATE ... RETURNING * into the session grid
+    rows = pd.DataFrame(cursor.fetchall(), columns=[d[0] for d in cursor.description])
+    rows = apply_stock_dtypes(rows).set_index('id')
+    df = load_stocks().set_index('id')
+    df = pd.concat([df, rows[~rows.index.isin(df.index)]])
+    df.loc[rows.index, rows.columns] = rows
+    st.session_state.stocks_df = df.reset_index()
+
+def drop_returned_rows(cursor):
+    # Drop rows from DELETE ... RETURNING id out of the session grid
+    ids = [row[0] for row in cursor.fetchall()]
+    df = load_stocks()
+    st.session_state.stocks_df = df[~df['id'].isin(ids)].reset_index(drop=True)
 
 # Stock input form
 st.subheader("Add New Stock Alert")
@@ -190,22 +345,19 @@ with st.form(key="add_stock_form"):
         else:
             price = get_current_price_nse(symbol)
             if price is not None:
-                conn = sqlite3.connect('stock_alerts.db')
+                conn = get_conn()
                 c = conn.cursor()
-                added_time = datetime.now(ist).isoformat()
-                c.execute("INSERT INTO stocks (id, symbol, alert_price, target_price, strategy, enabled, last_notified_alert, last_notified_target, last_notified_pre_alert, last_notified_pre_target, alert_trigger_time, target_trigger_time, status, added_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                added_time = int(time.time() * 1000)
+                c.execute("INSERT INTO stocks (id, symbol, alert_price, target_price, strategy, enabled, last_notified_alert, last_notified_target, last_notified_pre_alert, last_notified_pre_target, alert_trigger_time, target_trigger_time, status, added_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING *",
                          (str(uuid.uuid4()), symbol.upper(), alert_price, target_price, strategy, 1, 0, 0, 0, 0, None, None, 'Open', added_time))
-                conn.commit()
-                conn.close()
+                apply_returned_rows(c)
                 st.success(f"Added {symbol.upper()} to alerts!")
             else:
                 st.error(f"Invalid symbol {symbol.upper()}: No price data available")
 
 # Display and manage stocks
 st.subheader("Current Stock Alerts")
-conn = sqlite3.connect('stock_alerts.db')
-df = pd.read_sql_query("SELECT * FROM stocks", conn)
-conn.close()
+df = load_stocks()
 
 # Check if DataFrame is empty
 if df.empty:
@@ -214,41 +366,28 @@ else:
     # Remove any rows with invalid symbols
     df = df[df['symbol'].notna() & df['symbol'].str.strip().astype(bool)]
 
-    # Calculate additional metrics for display
-    def calculate_metrics(row):
-        if not isinstance(row['symbol'], str) or pd.isna(row['symbol']) or not row['symbol'].strip():
-            return pd.Series({
-                'Current Price': None,
-                'Target %': None,
-                'Remaining Target %': None,
-                'Duration (Days)': None,
-                'Duration (Date)': None
-            })
-        current_price = get_current_price_nse(row['symbol'])
-        target_percentage = abs(row['target_price'] - row['alert_price']) / row['alert_price'] * 100 if row['alert_price'] > 0 else 0
-        remaining_target_percentage = abs(row['target_price'] - current_price) / row['alert_price'] * 100 if row['alert_price'] > 0 and row['status'] == 'Open' and current_price is not None else 0
-        duration_days = duration_date = None
-        if row['alert_trigger_time'] and row['target_trigger_time']:
-            try:
-                alert_time = parse(row['alert_trigger_time'])
-                target_time = parse(row['target_trigger_time'])
-                duration = target_time - alert_time
-                duration_days = duration.days + duration.seconds / (24 * 3600)
-                duration_date = f"{duration.days} days, {int(duration.seconds / 3600)} hours"
-            except Exception:
-                duration_days = duration_date = None
-        return pd.Series({
-            'Current Price': current_price,
-            'Target %': target_percentage,
-            'Remaining Target %': remaining_target_percentage,
-            'Duration (Days)': duration_days,
-            'Duration (Date)': duration_date
-        })
-
-    # Prepare data for display
+    # Fetch all current prices in parallel before computing metrics
+    prices = get_current_prices_nse(df['symbol'].tolist())
+
+    # Calculate additional metrics for display as column operations
     display_df = df.copy().reset_index(drop=True)  # Ensure unique index
-    metrics = display_df.apply(calculate_metrics, axis=1)
-    display_df = pd.concat([display_df, metrics], axis=1)
+    display_df['Current Price'] = display_df['symbol'].map(prices).astype(float)
+    alert_base = display_df['alert_price'].where(display_df['alert_price'] > 0)
+    display_df['Target %'] = ((display_df['target_price'] - display_df['alert_price']).abs() / alert_base * 100).fillna(0)
+    display_df['Remaining Target %'] = (
+        (display_df['target_price'] - display_df['Current Price']).abs() / alert_base * 100
+    ).where(display_df['status'] == 'Open').fillna(0)
+    alert_dt = pd.to_datetime(display_df['alert_trigger_time'], unit='ms', utc=True)
+    target_dt = pd.to_datetime(display_df['target_trigger_time'], unit='ms', utc=True)
+    duration = target_dt - alert_dt
+    display_df['Duration (Days)'] = duration.dt.total_seconds() / (24 * 3600)
+    display_df['Duration (Date)'] = (
+        duration.dt.days.astype('Int64').astype(str) + " days, " +
+        (duration.dt.seconds // 3600).astype('Int64').astype(str) + " hours"
+    ).where(duration.notna())
+    # Render epoch-ms timestamps as IST strings
+    for col in ('alert_trigger_time', 'target_trigger_time', 'added_time'):
+        display_df[col] = pd.to_datetime(display_df[col], unit='ms', utc=True).dt.tz_convert(ist).dt.strftime('%Y-%m-%d %H:%M:%S')
 
     # Filter and search
     st.markdown('<div class="search-bar">', unsafe_allow_html=True)
@@ -279,53 +418,50 @@ else:
         if col not in filtered_df.columns:
             filtered_df[col] = None
 
-    # Display table with sorting
+    # Display table with sorting; column_config formats natively instead of per-cell Styler callbacks
     st.dataframe(
-        filtered_df[required_columns].style.apply(
-            lambda x: ['background-color: #e6f3ff' if x['status'] == 'Open' else 'background-color: #ffe6e6' for _ in x],
-            axis=1
-        ).format(
-            {
-                'alert_price': '₹{:.2f}',
-                'target_price': '₹{:.2f}',
-                'Current Price': lambda x: f'₹{x:.2f}' if pd.notna(x) else 'N/A',
-                'Target %': '{:.2f}%',
-                'Remaining Target %': '{:.2f}%',
-                'Duration (Days)': lambda x: f'{x:.2f}' if pd.notna(x) else 'N/A',
-                'Duration (Date)': lambda x: x if pd.notna(x) else 'N/A',
-                'alert_trigger_time': lambda x: x if pd.notna(x) else 'Not triggered',
-                'target_trigger_time': lambda x: x if pd.notna(x) else 'Not triggered',
-                'status': '{}'
-            },
-            na_rep='N/A'
-        ),
+        filtered_df[required_columns].fillna({
+            'Duration (Date)': 'N/A',
+            'alert_trigger_time': 'Not triggered',
+            'target_trigger_time': 'Not triggered'
+        }),
+        column_config={
+            'alert_price': st.column_config.NumberColumn(format='₹%.2f'),
+            'target_price': st.column_config.NumberColumn(format='₹%.2f'),
+            'Current Price': st.column_config.NumberColumn(format='₹%.2f'),
+            'Target %': st.column_config.NumberColumn(format='%.2f%%'),
+            'Remaining Target %': st.column_config.NumberColumn(format='%.2f%%'),
+            'Duration (Days)': st.column_config.NumberColumn(format='%.2f')
+        },
         use_container_width=True,
         height=400
     )
 
-    # Detailed view and management
-    for index, row in filtered_df.iterrows():
+    # Detailed view and management, paginated so each rerun only builds one page of widgets
+    PAGE_SIZE = 20
+    page_count = max(1, math.ceil(len(filtered_df) / PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+    page_df = filtered_df.iloc[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+    for row in page_df.to_dict('records'):
         with st.expander(f"{row['symbol']} - {row['strategy']}"):
             col1, col2, col3, col4 = st.columns(4)
             with col1:
                 if st.button("Delete", key=f"delete_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
+                    conn = get_conn()
                     c = conn.cursor()
-                    c.execute("DELETE FROM stocks WHERE id = ?", (row['id'],))
-                    conn.commit()
-                    conn.close()
+                    c.execute("DELETE FROM stocks WHERE id = ? RETURNING id", (row['id'],))
+                    drop_returned_rows(c)
                     st.rerun()
             with col2:
                 if st.button("Edit", key=f"edit_{row['id']}"):
                     st.session_state[f"edit_mode_{row['id']}"] = True
             with col3:
                 if st.button("Disable/Enable", key=f"toggle_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
+                    conn = get_conn()
                     c = conn.cursor()
                     new_status = 0 if row['enabled'] else 1
-                    c.execute("UPDATE stocks SET enabled = ? WHERE id = ?", (new_status, row['id']))
-                    conn.commit()
-                    conn.close()
+                    c.execute("UPDATE stocks SET enabled = ? WHERE id = ? RETURNING *", (new_status, row['id']))
+                    apply_returned_rows(c)
                     st.rerun()
             with col4:
                 st.write(f"Enabled: {'Yes' if row['enabled'] else 'No'}")
@@ -340,12 +476,11 @@ else:
                     with ecol3:
                         new_strategy = st.selectbox("New Strategy", strategies, index=strategies.index(row['strategy']) if row['strategy'] in strategies else 0, key=f"strat_{row['id']}")
                     if st.form_submit_button("Save Changes"):
-                        conn = sqlite3.connect('stock_alerts.db')
+                        conn = get_conn()
                         c = conn.cursor()
-                        c.execute("UPDATE stocks SET alert_price = ?, target_price = ?, strategy = ? WHERE id = ?",
+                        c.execute("UPDATE stocks SET alert_price = ?, target_price = ?, strategy = ? WHERE id = ? RETURNING *",
                                  (new_alert_price, new_target_price, new_strategy, row['id']))
-                        conn.commit()
-                        conn.close()
+                        apply_returned_rows(c)
                         st.session_state[f"edit_mode_{row['id']}"] = False
                         st.rerun()
 
@@ -355,13 +490,13 @@ else:
             st.write(f"Target %: {row['Target %']:.2f}%")
             if row['status'] == 'Open':
                 st.write(f"Remaining Target %: {row['Remaining Target %']:.2f}%")
-            st.write(f"Alert Trigger Time: {row['alert_trigger_time'] or 'Not triggered'}")
-            st.write(f"Target Trigger Time: {row['target_trigger_time'] or 'Not triggered'}")
+            st.write(f"Alert Trigger Time: {row['alert_trigger_time'] if pd.notna(row['alert_trigger_time']) else 'Not triggered'}")
+            st.write(f"Target Trigger Time: {row['target_trigger_time'] if pd.notna(row['target_trigger_time']) else 'Not triggered'}")
             if pd.notna(row['Duration (Date)']):
                 st.write(f"Target Duration: {row['Duration (Date)']}")
             if pd.notna(row['Duration (Days)']):
                 st.write(f"Target Duration (Days): {row['Duration (Days)']:.2f}")
-            st.write(f"Added Time: {row['added_time'] or 'N/A'}")
+            st.write(f"Added Time: {row['added_time'] if pd.notna(row['added_time']) else 'N/A'}")
 
 # Price checking and notification logic
 async def send_telegram_message(message):
@@ -370,91 +505,106 @@ async def send_telegram_message(message):
     except Exception as e:
         st.error(f"Failed to send Telegram message: {e}")
 
-def check_prices():
-    conn = sqlite3.connect('stock_alerts.db')
-    df = pd.read_sql_query("SELECT * FROM stocks WHERE enabled = 1", conn)
-    conn.close()
+# Telegram sends are drained by a long-lived event loop so check_prices never waits on them
+async def _notify_worker(queue):
+    interval = 1 / 25  # stay under Telegram's global bot rate limit
+    loop = asyncio.get_running_loop()
+    last_sent = 0.0
+    while True:
+        message = await queue.get()
+        await asyncio.sleep(max(0, last_sent + interval - loop.time()))
+        last_sent = loop.time()
+        await send_telegram_message(message)
+
+@st.cache_resource
+def get_notifier():
+    loop = asyncio.new_event_loop()
+    queue = asyncio.Queue()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(_notify_worker(queue), loop)
+    return loop, queue
+
+def enqueue_telegram_message(message):
+    loop, queue = get_notifier()
+    loop.call_soon_threadsafe(queue.put_nowait, message)
 
-    for _, row in df.iterrows():
-        if not isinstance(row['symbol'], str) or pd.isna(row['symbol']) or not row['symbol'].strip():
-            continue
+def check_prices():
+    conn = get_conn()
+    columns = ['id', 'symbol', 'alert_price', 'target_price', 'last_notified_pre_alert', 'last_notified_pre_target',
+               'alert_trigger_time', 'target_trigger_time', 'added_time']
+    df = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM stocks WHERE enabled = 1", conn,
+                           dtype={col: STOCK_DTYPES[col] for col in columns if col in STOCK_DTYPES})
+    df = df[df['symbol'].notna() & df['symbol'].str.strip().astype(bool)]
+    if df.empty:
+        return
+    prices = get_current_prices_nse(df['symbol'].tolist())
+    now_ms = int(time.time() * 1000)
+
+    # Evaluate every trigger condition as a column mask, then only visit the hits
+    df['current_price'] = df['symbol'].map(prices).astype(float)
+    price, alert_price, target_price = df['current_price'], df['alert_price'], df['target_price']
+    # Only trigger alerts for priced rows whose added_time has passed
+    live = price.notna() & (df['added_time'] < now_ms)
+    # Alert and target fire once, when their trigger time is still unset
+    crossed_alert = live & (alert_price > 0) & df['alert_trigger_time'].isna()
+    crossed_target = live & (target_price > 0) & df['target_trigger_time'].isna()
+    # Pre-alert / pre-target fire within 3% of the level, once per distinct price
+    near_alert = (live & (alert_price > 0) & ((price - alert_price).abs() <= alert_price * 0.03) &
+                  (price != df['last_notified_pre_alert']))
+    near_target = (live & (target_price > 0) & ((price - target_price).abs() <= target_price * 0.03) &
+                   (price != df['last_notified_pre_target']))
+
+    alert_updates, target_updates, pre_alert_updates, pre_target_updates = [], [], [], []
+    for row in df[crossed_alert].itertuples(index=False):
+        enqueue_telegram_message(f"🚨 Alert: {row.symbol} hit alert price ₹{row.alert_price:.2f}! Current: ₹{row.current_price:.2f}")
+        alert_updates.append((row.current_price, now_ms, row.id))
+    for row in df[crossed_target].itertuples(index=False):
+        enqueue_telegram_message(f"🎯 Target: {row.symbol} hit target price ₹{row.target_price:.2f}! Current: ₹{row.current_price:.2f}")
+        target_updates.append((row.current_price, now_ms, 'Closed', row.id))
+    for row in df[near_alert].itertuples(index=False):
+        enqueue_telegram_message(f"⚠️ Pre-Alert: {row.symbol} is near alert price ₹{row.alert_price:.2f} (within 3%)! Current: ₹{row.current_price:.2f}")
+        pre_alert_updates.append((row.current_price, row.id))
+    for row in df[near_target].itertuples(index=False):
+        enqueue_telegram_message(f"⚠️ Pre-Target: {row.symbol} is near target price ₹{row.target_price:.2f} (within 3%)! Current: ₹{row.current_price:.2f}")
+        pre_target_updates.append((row.current_price, row.id))
+
+    # Write all notification state for this tick in one transaction
+    if alert_updates or target_updates or pre_alert_updates or pre_target_updates:
         try:
-            current_price = get_current_price_nse(row['symbol'])
-            if current_price is None:
-                continue
-            current_time = datetime.now(ist)
-            added_time = parse(row['added_time']) if row['added_time'] else current_time
-
-            # Only trigger alerts if current time is after added_time
-            if current_time <= added_time:
-                continue
-
-            # Check alert price (only once when alert_trigger_time is None)
-            if (row['alert_price'] > 0 and row['alert_trigger_time'] is None and
-                (current_price <= row['alert_price'] or current_price >= row['alert_price'])):
-                message = f"🚨 Alert: {row['symbol']} hit alert price ₹{row['alert_price']:.2f}! Current: ₹{current_price:.2f}"
-                asyncio.run(send_telegram_message(message))
-                conn = sqlite3.connect('stock_alerts.db')
-                c = conn.cursor()
-                c.execute("UPDATE stocks SET last_notified_alert = ?, alert_trigger_time = ? WHERE id = ?",
-                         (current_price, current_time.isoformat(), row['id']))
-                conn.commit()
-                conn.close()
-
-            # Check target price (only once when target_trigger_time is None)
-            if (row['target_price'] > 0 and row['target_trigger_time'] is None and
-                (current_price <= row['target_price'] or current_price >= row['target_price'])):
-                message = f"🎯 Target: {row['symbol']} hit target price ₹{row['target_price']:.2f}! Current: ₹{current_price:.2f}"
-                asyncio.run(send_telegram_message(message))
-                conn = sqlite3.connect('stock_alerts.db')
-                c = conn.cursor()
-                c.execute("UPDATE stocks SET last_notified_target = ?, target_trigger_time = ?, status = ? WHERE id = ?",
-                         (current_price, current_time.isoformat(), 'Closed', row['id']))
-                conn.commit()
-                conn.close()
-
-            # Check for pre-alert (within 3% of alert price)
-            if row['alert_price'] > 0:
-                alert_threshold = row['alert_price'] * 0.03  # 3% range
-                pre_alert_lower = row['alert_price'] - alert_threshold
-                pre_alert_upper = row['alert_price'] + alert_threshold
-                if (pre_alert_lower <= current_price <= pre_alert_upper and 
-                    current_price != row['last_notified_pre_alert']):
-                    message = f"⚠️ Pre-Alert: {row['symbol']} is near alert price ₹{row['alert_price']:.2f} (within 3%)! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    c.execute("UPDATE stocks SET last_notified_pre_alert = ? WHERE id = ?", (current_price, row['id']))
-                    conn.commit()
-                    conn.close()
-
-            # Check for pre-target (within 3% of target price)
-            if row['target_price'] > 0:
-                target_threshold = row['target_price'] * 0.03  # 3% range
-                pre_target_lower = row['target_price'] - target_threshold
-                pre_target_upper = row['target_price'] + target_threshold
-                if (pre_target_lower <= current_price <= pre_target_upper and 
-                    current_price != row['last_notified_pre_target']):
-                    message = f"⚠️ Pre-Target: {row['symbol']} is near target price ₹{row['target_price']:.2f} (within 3%)! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    c.execute("UPDATE stocks SET last_notified_pre_target = ? WHERE id = ?", (current_price, row['id']))
-                    conn.commit()
-                    conn.close()
-
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("UPDATE stocks SET last_notified_alert = ?, alert_trigger_time = ? WHERE id = ?", alert_updates)
+            conn.executemany("UPDATE stocks SET last_notified_target = ?, target_trigger_time = ?, status = ? WHERE id = ?", target_updates)
+            conn.executemany("UPDATE stocks SET last_notified_pre_alert = ? WHERE id = ?", pre_alert_updates)
+            conn.executemany("UPDATE stocks SET last_notified_pre_target = ? WHERE id = ?", pre_target_updates)
+            conn.execute("COMMIT")
         except Exception as e:
-            st.error(f"Error checking {row['symbol']}: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logging.error(f"Failed to save notification state: {e}")
 
 # Schedule price checks
 def run_scheduler():
-    schedule.every(check_interval).minutes.do(check_prices)
+    # Monotonic deadline: no drift, and missed ticks are skipped
+    interval = check_interval * 60
+    deadline = time.monotonic()
     while True:
-        schedule.run_pending()
-        time.sleep(60)
-
-# Start scheduler in background thread
-if 'scheduler_thread' not in st.session_state:
-    st.session_state.scheduler_thread = True
+        # One failed tick must not end the process-wide scheduler thread
+        try:
+            check_prices()
+        except Exception:
+            logging.exception("Price check failed")
+        deadline += interval
+        if deadline < time.monotonic():
+            deadline = time.monotonic()
+        time.sleep(max(0, deadline - time.monotonic()))
+
+# Start one scheduler per process; module globals are reset on every rerun, so the
+# singleton lives in st.cache_resource (which locks its first call) rather than
+# per-session state
+@st.cache_resource
+def start_scheduler():
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
\ No newline at end of file
+    scheduler_thread.start()
+    return scheduler_thread
+
+start_scheduler()
\ No newline at end of file
@@ -1,11 +1,11 @@
 import streamlit as st
 import sqlite3
 import pandas as pd
+import numpy as np
 import yfinance as yf
 import asyncio
 import telegram
 import time
-import schedule
 import threading
 import uuid
 from datetime import datetime
@@ -13,7 +13,7 @@ import pytz
 import logging
 import io
 import csv
-import json
+from telegram.request import HTTPXRequest
 
 # Configure logging
 logging.basicConfig(
@@ -25,6 +25,22 @@ logging.basicConfig(
 # Set timezone to IST
 ist = pytz.timezone('Asia/Kolkata')
 
+# Hot-path UPDATEs, kept as single strings so the shared connection's statement cache reuses them
+SQL_UPD_ALERT = "UPDATE stocks SET alert_triggered = 1, last_notified_alert = ? WHERE id = ?"
+SQL_UPD_TARGET = "UPDATE stocks SET last_notified_target = ? WHERE id = ?"
+SQL_UPDATE_QUOTE = "UPDATE stocks SET last_price = ?, last_green_low = ?, last_green_high = ?, last_price_ts = ? WHERE id = ?"
+
+# Columns the stock list renders, shared by the full list and single-row reloads
+STOCK_COLUMNS = ("id, symbol, initial_price, alert_price, target_price, strategy, enabled, alert_triggered, created_at, "
+                 "last_price, last_green_low, last_green_high, last_price_ts")
+
+# Prices fit float32 and flags int8; narrower columns halve the bytes the check_prices masks touch.
+# UI reads keep prices as float64 so edits don't write float32 rounding back to the table.
+STOCK_DTYPES = {'initial_price': 'float32', 'alert_price': 'float32', 'target_price': 'float32',
+                'last_price': 'float32', 'last_green_low': 'float32', 'last_green_high': 'float32',
+                'enabled': 'int8', 'alert_triggered': 'int8', 'created_at': 'int64',
+                'last_notified_alert': 'int64', 'last_notified_target': 'int64', 'notification_cooldown': 'int32'}
+
 # Database setup
 def init_db():
     conn = sqlite3.connect('stock_alerts.db')
@@ -43,7 +59,11 @@ def init_db():
                   alert_triggered INTEGER DEFAULT 0, 
                   last_notified_alert INTEGER DEFAULT 0, 
                   last_notified_target INTEGER DEFAULT 0,
-                  notification_cooldown INTEGER DEFAULT 3600)''')
+                  notification_cooldown INTEGER DEFAULT 3600,
+                  last_price REAL,
+                  last_green_low REAL,
+                  last_green_high REAL,
+                  last_price_ts INTEGER)''')
     
     # Check for missing columns and add them
     c.execute("PRAGMA table_info(stocks)")
@@ -55,7 +75,11 @@ def init_db():
         ('alert_triggered', 'INTEGER', '0'),
         ('last_notified_alert', 'INTEGER', '0'),
         ('last_notified_target', 'INTEGER', '0'),
-        ('notification_cooldown', 'INTEGER', '3600')
+        ('notification_cooldown', 'INTEGER', '3600'),
+        ('last_price', 'REAL', 'NULL'),
+        ('last_green_low', 'REAL', 'NULL'),
+        ('last_green_high', 'REAL', 'NULL'),
+        ('last_price_ts', 'INTEGER', 'NULL')
     ]:
         if column not in columns:
             c.execute(f"ALTER TABLE stocks ADD COLUMN {column} {column_type} DEFAULT {default}")
@@ -64,57 +88,183 @@ def init_db():
     c.execute('''CREATE TABLE IF NOT EXISTS strategies
                  (id TEXT PRIMARY KEY, name TEXT)''')
     
+    # Daily bars already fetched from Yahoo, so refreshes only need the newest ones
+    c.execute('''CREATE TABLE IF NOT EXISTS history_cache
+                 (symbol TEXT, date TEXT, open REAL, high REAL, low REAL, close REAL,
+                  PRIMARY KEY (symbol, date))''')
+    
     # Create unique index to prevent duplicate stock-symbol-strategy combinations
     c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_symbol_strategy ON stocks (symbol, strategy)''')
     
+    # Partial index for the scheduler's enabled-only scan; gather planner stats once, when it's new
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_enabled'")
+    if c.fetchone() is None:
+        c.execute("CREATE INDEX idx_enabled ON stocks(enabled) WHERE enabled = 1")
+        c.execute("ANALYZE")
+    
     conn.commit()
     conn.close()
 
 # Initialize database
 init_db()
 
+# Shared by the UI and the scheduler thread; db_lock serialises writes
+@st.cache_resource
+def get_conn():
+    conn = sqlite3.connect('stock_alerts.db', check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+@st.cache_resource
+def get_db_lock():
+    return threading.Lock()
+
+# Enabled watchlist cached for the scheduler. UI writes that change it mark it dirty so
+# the next tick reloads it; check_prices applies its own writes to the cached copy.
+@st.cache_resource
+def get_watchlist():
+    dirty = threading.Event()
+    dirty.set()
+    return {'dirty': dirty, 'df': None}
+
+def mark_watchlist_dirty():
+    get_watchlist()['dirty'].set()
+
+# Read stock rows with STOCK_DTYPES applied (NULL integers read as 0); floats are only
+# narrowed to float32 for the check_prices watchlist
+def _load_stocks(query, params=(), narrow=False):
+    df = pd.read_sql_query(query, get_conn(), params=params)
+    dtypes = {col: dtype if narrow or not dtype.startswith('float') else 'float64'
+              for col, dtype in STOCK_DTYPES.items() if col in df.columns}
+    ints = [col for col, dtype in dtypes.items() if dtype.startswith('int')]
+    df[ints] = df[ints].fillna(0)
+    return df.astype(dtypes)
+
 # Telegram bot setup
 TELEGRAM_TOKEN = st.secrets["TELEGRAM_TOKEN"]
 CHAT_ID = st.secrets["CHAT_ID"]
-bot = telegram.Bot(token=TELEGRAM_TOKEN)
+# Pooled client so one cycle's messages go out concurrently over reused connections
+bot = telegram.Bot(token=TELEGRAM_TOKEN, request=HTTPXRequest(connection_pool_size=8))
+
+# yfinance caches shared by reruns and the scheduler thread: one Ticker per symbol, and
+# each fetch result kept for CACHE_TTL seconds
+CACHE_TTL = 60
+
+@st.cache_resource
+def get_yf_caches():
+    return {}, {}
 
-# Function to fetch current price and candlestick data using yfinance
 def get_stock_data(symbol):
+    _, data_cache = get_yf_caches()
+    cached = data_cache.get(symbol)
+    if cached and time.time() - cached[0] < CACHE_TTL:
+        return cached[1]
+    result = fetch_stock_data(symbol)
+    if result[0] is not None:
+        data_cache[symbol] = (time.time(), result)
+    return result
+
+# Most recent green candle (close > open) as (low, high), or None
+def latest_green_candle(hist):
+    # Index of the last green bar straight from the arrays, without building a filtered frame
+    hits = np.flatnonzero(hist['Close'].to_numpy() > hist['Open'].to_numpy())
+    if hits.size == 0:
+        return None
+    i = hits[-1]
+    return float(hist['Low'].to_numpy()[i]), float(hist['High'].to_numpy()[i])
+
+# Price and green candle for many symbols from one threaded yf.download; results also
+# seed the per-symbol cache. The last daily close stands in for the live quote.
+def get_stock_data_batch(symbols):
+    tickers = {symbol: symbol.upper() if symbol.endswith('.NS') else f"{symbol.upper()}.NS" for symbol in symbols}
+    results = {}
+    if not tickers:
+        return results
+    try:
+        hist = yf.download(sorted(set(tickers.values())), period="20d", interval="1d",
+                           group_by='ticker', threads=True, progress=False)
+    except Exception as e:
+        logging.error(f"Batch download failed for {len(tickers)} symbols: {e}")
+        return results
+    _, data_cache = get_yf_caches()
+    for symbol, ticker in tickers.items():
+        try:
+            frame = hist[ticker] if isinstance(hist.columns, pd.MultiIndex) else hist
+            frame = frame.dropna(subset=['Close'])
+        except KeyError:
+            frame = hist.iloc[0:0]
+        if frame.empty:
+            logging.warning(f"No historical data for {symbol}")
+            continue
+        results[symbol] = (float(frame['Close'].iloc[-1]), latest_green_candle(frame))
+        data_cache[symbol] = (time.time(), results[symbol])
+    return results
+
+# Last 20 daily bars for a ticker, served from history_cache; only bars from the last
+# cached day onwards are fetched (that day is refetched since its bar may have been intraday)
+def load_history(ticker, stock):
+    conn = get_conn()
+    last_date = conn.execute("SELECT MAX(date) FROM history_cache WHERE symbol = ?", (ticker,)).fetchone()[0]
+    if last_date is None:
+        fresh = stock.history(period="20d", interval="1d")
+    else:
+        fresh = stock.history(start=last_date, interval="1d")
+    if not fresh.empty:
+        rows = [(ticker, ts.strftime('%Y-%m-%d'), float(bar.Open), float(bar.High), float(bar.Low), float(bar.Close))
+                for ts, bar in zip(fresh.index, fresh.itertuples())]
+        with get_db_lock():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT OR REPLACE INTO history_cache (symbol, date, open, high, low, close) VALUES (?, ?, ?, ?, ?, ?)", rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    return pd.read_sql_query("""SELECT * FROM (SELECT date, open AS Open, high AS High, low AS Low, close AS Close
+                                FROM history_cache WHERE symbol = ? ORDER BY date DESC LIMIT 20) ORDER BY date""",
+                             conn, params=(ticker,))
+
+# Latest quote per stock, stored so the stock list renders without calling Yahoo
+def quote_rows(ids, symbols, stock_data, fetched_at):
+    rows = []
+    for stock_id, symbol in zip(ids, symbols):
+        if symbol in stock_data:
+            price, green = stock_data[symbol]
+            green_low, green_high = green if green else (None, None)
+            rows.append((price, green_low, green_high, fetched_at, stock_id))
+    return rows
+
+# Function to fetch current price and candlestick data using yfinance
+def fetch_stock_data(symbol):
     try:
         # Ensure correct ticker format for Indian stocks
         ticker = symbol.upper() if symbol.endswith('.NS') else f"{symbol.upper()}.NS"
-        stock = yf.Ticker(ticker)
-        
-        # Fetch current price
-        info = stock.info
-        current_price = info.get('regularMarketPrice', None)
-        if current_price is None:
-            logging.warning(f"No valid current price for {symbol}. Response: {info}")
-            return None, None
+        ticker_cache, _ = get_yf_caches()
+        stock = ticker_cache.get(ticker)
+        if stock is None:
+            stock = ticker_cache[ticker] = yf.Ticker(ticker)
         
-        # Fetch 20 days of daily candlestick data
-        hist = stock.history(period="20d", interval="1d")
+        # 20 days of daily candlestick data; the latest close doubles as the current price
+        hist = load_history(ticker, stock)
         if hist.empty:
             logging.warning(f"No historical data for {symbol}")
-            return current_price, None
+            return None, None
+        current_price = float(hist['Close'].iloc[-1])
         
         # Find the most recent green candle (close > open)
-        green_candles = hist[hist['Close'] > hist['Open']]
-        if green_candles.empty:
+        green_candle = latest_green_candle(hist)
+        if green_candle is None:
             logging.warning(f"No green candles found for {symbol}")
             return current_price, None
-        
-        latest_green_candle = green_candles.iloc[-1]
-        green_low = latest_green_candle['Low']
-        green_high = latest_green_candle['High']
+        green_low, green_high = green_candle
         
         logging.info(f"Fetched data for {symbol}: Current price ₹{current_price:.2f}, Green candle low ₹{green_low:.2f}, High ₹{green_high:.2f}")
         return current_price, (green_low, green_high)
     
-    except json.JSONDecodeError as e:
-        logging.error(f"JSON decode error for {symbol}: {e}. Response may be empty or malformed.")
-        st.warning(f"Failed to fetch data for {symbol}: Invalid or empty response from Yahoo Finance.")
-        return None, None
     except Exception as e:
         logging.error(f"Error fetching data for {symbol}: {e}")
         st.warning(f"Error fetching data for {symbol}: {e}")
@@ -128,42 +278,41 @@ st.sidebar.header("Configuration")
 check_interval = st.sidebar.slider("Price Check Interval (minutes)", 1, 60, 5)
 default_cooldown = st.sidebar.number_input("Notification Cooldown (seconds)", min_value=300, max_value=86400, value=3600)
 
+# Strategies rarely change; cached across reruns and cleared when one is added
+@st.cache_data(ttl=300, show_spinner=False)
+def load_strategies():
+    return [row[0] for row in get_conn().execute("SELECT name FROM strategies").fetchall()] or ["V20"]
+
 # Strategy management
 st.sidebar.subheader("Manage Strategies")
 new_strategy = st.sidebar.text_input("Add New Strategy")
 if st.sidebar.button("Add Strategy"):
     if new_strategy:
-        conn = sqlite3.connect('stock_alerts.db')
+        conn = get_conn()
         c = conn.cursor()
-        c.execute("INSERT INTO strategies (id, name) VALUES (?, ?)", (str(uuid.uuid4()), new_strategy))
-        conn.commit()
-        conn.close()
+        with get_db_lock():
+            c.execute("INSERT INTO strategies (id, name) VALUES (?, ?)", (str(uuid.uuid4()), new_strategy))
+        load_strategies.clear()
         st.sidebar.success(f"Strategy '{new_strategy}' added!")
         logging.info(f"Added strategy: {new_strategy}")
 
 # Load strategies
-conn = sqlite3.connect('stock_alerts.db')
-c = conn.cursor()
-c.execute("SELECT name FROM strategies")
-strategies = [row[0] for row in c.fetchall()]
-conn.close()
-if not strategies:
-    strategies = ["V20"]
+strategies = load_strategies()
 
 # Export stocks to CSV
 def export_stocks_to_csv():
-    conn = sqlite3.connect('stock_alerts.db')
+    conn = get_conn()
     df = pd.read_sql_query("SELECT * FROM stocks", conn)
-    conn.close()
     
-    # Convert timestamps to human-readable format
-    df['created_at'] = df['created_at'].apply(lambda x: datetime.fromtimestamp(x, tz=ist).strftime('%Y-%m-%d %H:%M:%S') if x > 0 else '')
-    df['last_notified_alert'] = df['last_notified_alert'].apply(lambda x: datetime.fromtimestamp(x, tz=ist).strftime('%Y-%m-%d %H:%M:%S') if x > 0 else '')
-    df['last_notified_target'] = df['last_notified_target'].apply(lambda x: datetime.fromtimestamp(x, tz=ist).strftime('%Y-%m-%d %H:%M:%S') if x > 0 else '')
+    # Convert timestamps to human-readable format, a whole column at a time
+    for col in ('created_at', 'last_notified_alert', 'last_notified_target'):
+        mask = df[col] > 0
+        formatted = pd.to_datetime(df[col].where(mask), unit='s', utc=True).dt.tz_convert(ist).dt.strftime('%Y-%m-%d %H:%M:%S')
+        df[col] = formatted.where(mask, '')
     
     # Convert DataFrame to CSV
     output = io.StringIO()
-    df.to_csv(output, index=False)
+    df.to_csv(output, index=False, chunksize=10000)
     return output.getvalue()
 
 st.sidebar.subheader("Export Stocks")
@@ -177,6 +326,69 @@ if st.sidebar.button("Export All Stocks to CSV"):
     )
     logging.info("Exported all stocks to CSV")
 
+# V20 alert price: 20% gain on the current price, snapped to the green candle low when within 1%
+def v20_alert_price(current_price, green_candle_data):
+    alert_price = current_price * 1.20  # 20% gain
+    if green_candle_data:
+        green_low, _ = green_candle_data
+        # Align alert price with green candle low if within 1%
+        if abs(alert_price - green_low) / alert_price <= 0.01:
+            alert_price = green_low
+    return alert_price
+
+# Bulk import: prices for every row come from one batched download and all inserts share
+# one transaction; rows that duplicate a symbol/strategy pair are skipped
+st.sidebar.subheader("Import Stocks")
+import_file = st.sidebar.file_uploader("CSV with symbol, target_price and optional strategy columns", type="csv")
+if import_file is not None and st.sidebar.button("Import Stocks"):
+    import_df = pd.read_csv(import_file)
+    if not {'symbol', 'target_price'}.issubset(import_df.columns):
+        st.sidebar.error("CSV must have 'symbol' and 'target_price' columns")
+    else:
+        # Rows need a symbol, a numeric target and a known strategy (blank means the default)
+        default_strategy = "V20" if "V20" in strategies else strategies[0]
+        total = len(import_df)
+        import_df['symbol'] = import_df['symbol'].fillna('').astype(str).str.strip().str.upper()
+        import_df['target_price'] = pd.to_numeric(import_df['target_price'], errors='coerce')
+        if 'strategy' not in import_df.columns:
+            import_df['strategy'] = default_strategy
+        import_df['strategy'] = import_df['strategy'].fillna('').astype(str).str.strip().replace('', default_strategy)
+        valid = (import_df['symbol'] != '') & import_df['target_price'].notna() & import_df['strategy'].isin(strategies)
+        skipped = [f"row {index + 2}" for index in import_df.index[~valid]]
+        import_df = import_df[valid]
+        stock_data = get_stock_data_batch(import_df['symbol'].tolist())
+        created_at = int(time.time())
+        rows = []
+        for row in import_df.itertuples():
+            if row.symbol not in stock_data:
+                logging.warning(f"Skipping import of {row.symbol}: No price data")
+                skipped.append(f"{row.symbol} (no price data)")
+                continue
+            current_price, green_candle_data = stock_data[row.symbol]
+            rows.append((str(uuid.uuid4()), row.symbol, current_price, v20_alert_price(current_price, green_candle_data),
+                         float(row.target_price), row.strategy, 1, created_at, 0, 0, 0, default_cooldown))
+        if skipped:
+            st.sidebar.warning(f"Skipped {len(skipped)} rows (missing symbol, invalid target price, unknown strategy "
+                               f"or no price data): {', '.join(skipped)}")
+        conn = get_conn()
+        with get_db_lock():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = conn.total_changes
+                conn.executemany("""INSERT OR IGNORE INTO stocks 
+                                    (id, symbol, initial_price, alert_price, target_price, strategy, enabled, created_at, 
+                                    alert_triggered, last_notified_alert, last_notified_target, notification_cooldown) 
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+                imported = conn.total_changes - before
+                conn.execute("COMMIT")
+                mark_watchlist_dirty()
+                st.sidebar.success(f"Imported {imported} of {total} stocks")
+                logging.info(f"Imported {imported} of {total} stocks from CSV")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                st.sidebar.error(f"Import failed: {e}")
+                logging.error(f"Stock import failed: {e}")
+
 # Stock input form
 st.subheader("Add New Stock Alert (V20 Strategy)")
 with st.form(key="add_stock_form"):
@@ -191,7 +403,7 @@ with st.form(key="add_stock_form"):
 
     if submit_button and symbol:
         # Check for duplicate stock-symbol-strategy combination
-        conn = sqlite3.connect('stock_alerts.db')
+        conn = get_conn()
         c = conn.cursor()
         c.execute("SELECT id FROM stocks WHERE symbol = ? AND strategy = ?", (symbol.upper(), strategy))
         existing_stock = c.fetchone()
@@ -199,112 +411,139 @@ with st.form(key="add_stock_form"):
         if existing_stock:
             st.error(f"Stock {symbol.upper()} with strategy '{strategy}' already exists!")
             logging.warning(f"Attempted to add duplicate stock {symbol.upper()} with strategy {strategy}")
-            conn.close()
         else:
             current_price, green_candle_data = get_stock_data(symbol)
             if current_price is not None:
                 # Calculate V20 range low price (20% gain from current price)
-                alert_price = current_price * 1.20  # 20% gain
-                if green_candle_data:
-                    green_low, _ = green_candle_data
-                    # Align alert price with green candle low if within 1%
-                    if abs(alert_price - green_low) / alert_price <= 0.01:
-                        alert_price = green_low
+                alert_price = v20_alert_price(current_price, green_candle_data)
                 
                 created_at = int(time.time())
                 try:
-                    c.execute("""INSERT INTO stocks 
-                                 (id, symbol, initial_price, alert_price, target_price, strategy, enabled, created_at, 
-                                 alert_triggered, last_notified_alert, last_notified_target, notification_cooldown) 
-                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                             (str(uuid.uuid4()), symbol.upper(), current_price, alert_price, target_price, strategy, 1, 
-                              created_at, 0, 0, 0, default_cooldown))
-                    conn.commit()
+                    with get_db_lock():
+                        c.execute("""INSERT INTO stocks 
+                                     (id, symbol, initial_price, alert_price, target_price, strategy, enabled, created_at, 
+                                     alert_triggered, last_notified_alert, last_notified_target, notification_cooldown) 
+                                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                 (str(uuid.uuid4()), symbol.upper(), current_price, alert_price, target_price, strategy, 1, 
+                                  created_at, 0, 0, 0, default_cooldown))
+                    mark_watchlist_dirty()
                     st.success(f"Added {symbol.upper()} with V20 alert price ₹{alert_price:.2f} (20% gain) and target price ₹{target_price:.2f}")
                     logging.info(f"Added stock {symbol.upper()} with initial price ₹{current_price:.2f}, alert price ₹{alert_price:.2f}, target price ₹{target_price:.2f}, strategy {strategy}")
                 except sqlite3.IntegrityError:
                     st.error(f"Stock {symbol.upper()} with strategy '{strategy}' already exists!")
                     logging.warning(f"IntegrityError: Attempted to add duplicate stock {symbol.upper()} with strategy {strategy}")
-                conn.close()
             else:
                 st.error(f"Invalid symbol {symbol.upper()}: No price data available. Ensure the symbol is correct (e.g., BAJAJHFL.NS).")
                 logging.error(f"Failed to add stock {symbol.upper()}: No price data")
-                conn.close()
 
 # Display and manage stocks
 st.subheader("Current Stock Alerts (V20 Strategy)")
-conn = sqlite3.connect('stock_alerts.db')
-df = pd.read_sql_query("SELECT * FROM stocks", conn)
-conn.close()
+conn = get_conn()
+df = _load_stocks(f"SELECT {STOCK_COLUMNS} FROM stocks")
 
-if not df.empty:
-    for index, row in df.iterrows():
-        with st.expander(f"{row['symbol']} - {row['strategy']}"):
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                if st.button("Delete", key=f"delete_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
+# Prices shown below are the scheduler's last fetch; refresh them on demand with one batched download
+if not df.empty and st.button("Refresh Prices Now"):
+    rows = quote_rows(df['id'], df['symbol'], get_stock_data_batch(df['symbol'].tolist()), int(time.time()))
+    if rows:
+        with get_db_lock():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(SQL_UPDATE_QUOTE, rows)
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                logging.error(f"Failed to save refreshed prices: {e}")
+    st.rerun()
+
+def load_stock_row(stock_id):
+    rows = _load_stocks(f"SELECT {STOCK_COLUMNS} FROM stocks WHERE id = ?", (stock_id,))
+    return None if rows.empty else rows.iloc[0]
+
+# Each stock is a fragment: its buttons rerun only that expander, which re-reads its own row
+# (None once deleted) instead of re-rendering the whole list
+@st.fragment
+def render_stock(stock_id, row):
+    row_key = f"stock_row_{stock_id}"
+    if row_key in st.session_state:
+        row = st.session_state[row_key]
+        if row is None:
+            return
+    with st.expander(f"{row['symbol']} - {row['strategy']}"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            if st.button("Delete", key=f"delete_{row['id']}"):
+                conn = get_conn()
+                c = conn.cursor()
+                with get_db_lock():
                     c.execute("DELETE FROM stocks WHERE id = ?", (row['id'],))
-                    conn.commit()
-                    conn.close()
-                    st.experimental_rerun()
-                    logging.info(f"Deleted stock {row['symbol']}")
-            with col2:
-                if st.button("Edit", key=f"edit_{row['id']}"):
-                    st.session_state[f"edit_mode_{row['id']}"] = True
-            with col3:
-                if st.button("Disable/Enable", key=f"toggle_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    new_status = 0 if row['enabled'] else 1
+                mark_watchlist_dirty()
+                logging.info(f"Deleted stock {row['symbol']}")
+                st.session_state[row_key] = None
+                st.rerun(scope="fragment")
+        with col2:
+            if st.button("Edit", key=f"edit_{row['id']}"):
+                st.session_state[f"edit_mode_{row['id']}"] = True
+        with col3:
+            if st.button("Disable/Enable", key=f"toggle_{row['id']}"):
+                conn = get_conn()
+                c = conn.cursor()
+                new_status = 0 if row['enabled'] else 1
+                with get_db_lock():
                     c.execute("UPDATE stocks SET enabled = ? WHERE id = ?", (new_status, row['id']))
-                    conn.commit()
-                    conn.close()
-                    st.experimental_rerun()
-                    logging.info(f"{'Enabled' if new_status else 'Disabled'} stock {row['symbol']}")
-            with col4:
-                st.write(f"Enabled: {'Yes' if row['enabled'] else 'No'}")
-
-            if st.session_state.get(f"edit_mode_{row['id']}", False):
-                with st.form(key=f"edit_form_{row['id']}"):
-                    ecol1, ecol2, ecol3 = st.columns(3)
-                    with ecol1:
-                        new_alert_price = st.number_input("New Alert Price (V20 Low)", value=float(row['alert_price']), key=f"alert_{row['id']}")
-                    with ecol2:
-                        new_target_price = st.number_input("New Target Price (V20 High)", value=float(row['target_price']), key=f"target_{row['id']}")
-                    with ecol3:
-                        new_strategy = st.selectbox("New Strategy", strategies, index=strategies.index(row['strategy']), key=f"strat_{row['id']}")
-                    if st.form_submit_button("Save Changes"):
-                        conn = sqlite3.connect('stock_alerts.db')
-                        c = conn.cursor()
-                        try:
+                mark_watchlist_dirty()
+                logging.info(f"{'Enabled' if new_status else 'Disabled'} stock {row['symbol']}")
+                st.session_state[row_key] = load_stock_row(stock_id)
+                st.rerun(scope="fragment")
+        with col4:
+            st.write(f"Enabled: {'Yes' if row['enabled'] else 'No'}")
+
+        if st.session_state.get(f"edit_mode_{row['id']}", False):
+            with st.form(key=f"edit_form_{row['id']}"):
+                ecol1, ecol2, ecol3 = st.columns(3)
+                with ecol1:
+                    new_alert_price = st.number_input("New Alert Price (V20 Low)", value=float(row['alert_price']), key=f"alert_{row['id']}")
+                with ecol2:
+                    new_target_price = st.number_input("New Target Price (V20 High)", value=float(row['target_price']), key=f"target_{row['id']}")
+                with ecol3:
+                    new_strategy = st.selectbox("New Strategy", strategies, index=strategies.index(row['strategy']) if row['strategy'] in strategies else 0, key=f"strat_{row['id']}")
+                if st.form_submit_button("Save Changes"):
+                    conn = get_conn()
+                    c = conn.cursor()
+                    try:
+                        with get_db_lock():
                             c.execute("UPDATE stocks SET alert_price = ?, target_price = ?, strategy = ? WHERE id = ?",
                                      (new_alert_price, new_target_price, new_strategy, row['id']))
-                            conn.commit()
-                            st.session_state[f"edit_mode_{row['id']}"] = False
-                            st.experimental_rerun()
-                            logging.info(f"Updated stock {row['symbol']} with new alert price ₹{new_alert_price:.2f}, target price ₹{new_target_price:.2f}, strategy {new_strategy}")
-                        except sqlite3.IntegrityError:
-                            st.error(f"Cannot update: Stock {row['symbol']} with strategy '{new_strategy}' already exists!")
-                            logging.warning(f"IntegrityError: Attempted to update stock {row['symbol']} to duplicate strategy {new_strategy}")
-                        conn.close()
-
-            st.write(f"Initial Price: ₹{row['initial_price']:.2f}")
-            st.write(f"V20 Alert Price (20% Gain): ₹{row['alert_price']:.2f}")
-            st.write(f"Target Price (V20 High): ₹{row['target_price']:.2f}")
-            st.write(f"Alert Triggered: {'Yes' if row['alert_triggered'] else 'No'}")
-            created_at = datetime.fromtimestamp(row['created_at'], tz=ist).strftime('%Y-%m-%d %H:%M:%S') if row['created_at'] > 0 else 'N/A'
-            st.write(f"Created At: {created_at}")
-            current_price, green_candle_data = get_stock_data(row['symbol'])
-            if current_price:
-                st.write(f"Current Price: ₹{current_price:.2f}")
-                if green_candle_data:
-                    green_low, green_high = green_candle_data
-                    st.write(f"Latest Green Candle Low: ₹{green_low:.2f}")
-                    st.write(f"Latest Green Candle High: ₹{green_high:.2f}")
-            else:
-                st.write("Current Price: Unavailable")
+                        mark_watchlist_dirty()
+                        st.session_state[f"edit_mode_{row['id']}"] = False
+                        logging.info(f"Updated stock {row['symbol']} with new alert price ₹{new_alert_price:.2f}, target price ₹{new_target_price:.2f}, strategy {new_strategy}")
+                        st.session_state[row_key] = load_stock_row(stock_id)
+                        st.rerun(scope="fragment")
+                    except sqlite3.IntegrityError:
+                        st.error(f"Cannot update: Stock {row['symbol']} with strategy '{new_strategy}' already exists!")
+                        logging.warning(f"IntegrityError: Attempted to update stock {row['symbol']} to duplicate strategy {new_strategy}")
+
+        st.write(f"Initial Price: ₹{row['initial_price']:.2f}")
+        st.write(f"V20 Alert Price (20% Gain): ₹{row['alert_price']:.2f}")
+        st.write(f"Target Price (V20 High): ₹{row['target_price']:.2f}")
+        st.write(f"Alert Triggered: {'Yes' if row['alert_triggered'] else 'No'}")
+        created_at = datetime.fromtimestamp(row['created_at'], tz=ist).strftime('%Y-%m-%d %H:%M:%S') if row['created_at'] > 0 else 'N/A'
+        st.write(f"Created At: {created_at}")
+        if pd.notna(row['last_price']):
+            price_time = datetime.fromtimestamp(row['last_price_ts'], tz=ist).strftime('%Y-%m-%d %H:%M:%S')
+            st.write(f"Current Price: ₹{row['last_price']:.2f} (as of {price_time})")
+            if pd.notna(row['last_green_low']):
+                st.write(f"Latest Green Candle Low: ₹{row['last_green_low']:.2f}")
+                st.write(f"Latest Green Candle High: ₹{row['last_green_high']:.2f}")
+        else:
+            st.write("Current Price: Unavailable")
+
+# A full run has just re-read every row, so drop rows refreshed by earlier fragment runs
+for key in [k for k in st.session_state if k.startswith("stock_row_")]:
+    del st.session_state[key]
+
+if not df.empty:
+    for index, row in df.iterrows():
+        render_stock(row['id'], row)
 
 # Price checking and notification logic
 async def send_telegram_message(message):
@@ -315,66 +554,132 @@ async def send_telegram_message(message):
         logging.error(f"Failed to send Telegram message: {e}")
         st.error(f"Failed to send Telegram message: {e}")
 
+# One long-lived event loop for Telegram, instead of a fresh loop and TLS session per message
+@st.cache_resource
+def get_telegram_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+async def send_telegram_messages(messages):
+    await asyncio.gather(*(send_telegram_message(message) for message in messages))
+
+# Join a cycle's alerts into as few messages as fit Telegram's length limit,
+# splitting only between alerts
+TELEGRAM_MAX_LENGTH = 4096
+
+def batch_messages(messages):
+    batches, current = [], ""
+    for message in messages:
+        candidate = f"{current}\n\n{message}" if current else message
+        if len(candidate) <= TELEGRAM_MAX_LENGTH:
+            current = candidate
+        else:
+            if current:
+                batches.append(current)
+            current = message[:TELEGRAM_MAX_LENGTH]
+    if current:
+        batches.append(current)
+    return batches
+
+def send_all(messages):
+    if messages:
+        asyncio.run_coroutine_threadsafe(send_telegram_messages(batch_messages(messages)), get_telegram_loop()).result()
+
 def check_prices():
-    conn = sqlite3.connect('stock_alerts.db')
-    df = pd.read_sql_query("SELECT * FROM stocks WHERE enabled = 1", conn)
-    conn.close()
+    conn = get_conn()
+    watchlist = get_watchlist()
+    if watchlist['dirty'].is_set():
+        watchlist['dirty'].clear()
+        watchlist['df'] = _load_stocks("SELECT id, symbol, alert_price, target_price, alert_triggered, last_notified_alert, "
+                                       "last_notified_target, notification_cooldown, created_at FROM stocks WHERE enabled = 1",
+                                       narrow=True)
+    df = watchlist['df']
 
-    current_time = time.time()
+    current_time = int(time.time())
+    stock_data = get_stock_data_batch(df['symbol'].tolist())
 
-    for _, row in df.iterrows():
-        try:
-            current_price, green_candle_data = get_stock_data(row['symbol'])
-            if current_price is None or green_candle_data is None:
-                continue
-            green_low, green_high = green_candle_data
-
-            # Skip notifications if stock was just added and price is already at/beyond alert price
-            if current_time - row['created_at'] < 60 and row['alert_triggered'] == 0:
-                if abs(current_price - row['alert_price']) / row['alert_price'] <= 0.01:
-                    logging.info(f"Skipping initial alert notification for {row['symbol']} as price is already at/beyond V20 alert price")
-                    continue
-
-            # Check V20 alert price (20% gain aligned with green candle low)
-            if row['alert_price'] > 0 and row['alert_triggered'] == 0:
-                last_alert_time = row['last_notified_alert'] if row['last_notified_alert'] > 0 else row['created_at']
-                if (current_time - last_alert_time >= row['notification_cooldown'] and
-                    current_price >= row['alert_price'] and
-                    abs(current_price - green_low) / green_low <= 0.01):  # Within 1% of green candle low
-                    message = f"🚨 V20 Alert: {row['symbol']} hit alert price ₹{row['alert_price']:.2f} (20% gain, green candle low)! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    c.execute("UPDATE stocks SET alert_triggered = 1, last_notified_alert = ? WHERE id = ?", (current_time, row['id']))
-                    conn.commit()
-                    conn.close()
-                    logging.info(f"Alert triggered for {row['symbol']} at ₹{current_price:.2f}")
-
-            # Check target price (V20 high aligned with green candle high)
-            if row['target_price'] > 0 and row['alert_triggered'] == 1:
-                last_target_time = row['last_notified_target'] if row['last_notified_target'] > 0 else row['created_at']
-                if (current_time - last_target_time >= row['notification_cooldown'] and
-                    current_price >= row['target_price'] and
-                    abs(current_price - green_high) / green_high <= 0.01):  # Within 1% of green candle high
-                    message = f"🎯 V20 Target: {row['symbol']} hit target price ₹{row['target_price']:.2f} (green candle high)! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    c.execute("UPDATE stocks SET last_notified_target = ? WHERE id = ?", (current_time, row['id']))
-                    conn.commit()
-                    conn.close()
-                    logging.info(f"Target triggered for {row['symbol']} at ₹{current_price:.2f}")
+    # Quotes as columns (NaN where a price or green candle is unavailable)
+    quotes = {symbol: (price, green[0], green[1]) for symbol, (price, green) in stock_data.items() if green is not None}
+    df = df.join(pd.DataFrame.from_dict(quotes, orient='index', columns=['current_price', 'green_low', 'green_high']), on='symbol')
+    # Quotes are rounded to float32 like the stored prices so equal values compare equal
+    price = df['current_price'].to_numpy(dtype=np.float32)
+    green_low = df['green_low'].to_numpy(dtype=np.float32)
+    green_high = df['green_high'].to_numpy(dtype=np.float32)
+    alert_px = df['alert_price'].to_numpy()
+    target_px = df['target_price'].to_numpy()
+    triggered = df['alert_triggered'].to_numpy()
+    created_at = df['created_at'].to_numpy()
+    cooldown = df['notification_cooldown'].to_numpy()
+    last_alert = df['last_notified_alert'].to_numpy()
+    last_target = df['last_notified_target'].to_numpy()
+
+    # Every condition as one numpy mask; only the hit rows are visited below
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Skip notifications if stock was just added and price is already at/beyond alert price
+        just_added = ((current_time - created_at < 60) & (triggered == 0) &
+                      (np.abs(price - alert_px) / alert_px <= 0.01))
+        live = ~np.isnan(price) & ~just_added
+        # Check V20 alert price (20% gain, within 1% of green candle low)
+        hit_alert = (live & (alert_px > 0) & (triggered == 0) &
+                     (current_time - np.where(last_alert > 0, last_alert, created_at) >= cooldown) &
+                     (price >= alert_px) & (np.abs(price - green_low) / green_low <= 0.01))
+        # Check target price (V20 high, within 1% of green candle high)
+        hit_target = (live & (target_px > 0) & (triggered == 1) &
+                      (current_time - np.where(last_target > 0, last_target, created_at) >= cooldown) &
+                      (price >= target_px) & (np.abs(price - green_high) / green_high <= 0.01))
 
-        except Exception as e:
-            logging.error(f"Error checking {row['symbol']}: {e}")
-            st.error(f"Error checking {row['symbol']}: {e}")
+    for symbol in df.loc[just_added & ~np.isnan(price), 'symbol']:
+        logging.info(f"Skipping initial alert notification for {symbol} as price is already at/beyond V20 alert price")
+
+    messages = []
+    alert_updates = []
+    target_updates = []
+    quote_updates = quote_rows(df['id'], df['symbol'], stock_data, int(current_time))
+    for row in df[hit_alert].itertuples():
+        messages.append(f"🚨 V20 Alert: {row.symbol} hit alert price ₹{row.alert_price:.2f} (20% gain, green candle low)! Current: ₹{row.current_price:.2f}")
+        alert_updates.append((current_time, row.id))
+        logging.info(f"Alert triggered for {row.symbol} at ₹{row.current_price:.2f}")
+    for row in df[hit_target].itertuples():
+        messages.append(f"🎯 V20 Target: {row.symbol} hit target price ₹{row.target_price:.2f} (green candle high)! Current: ₹{row.current_price:.2f}")
+        target_updates.append((current_time, row.id))
+        logging.info(f"Target triggered for {row.symbol} at ₹{row.current_price:.2f}")
+
+    send_all(messages)
+
+    # Write all notification state for this tick in one transaction
+    if alert_updates or target_updates or quote_updates:
+        with get_db_lock():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(SQL_UPD_ALERT, alert_updates)
+                conn.executemany(SQL_UPD_TARGET, target_updates)
+                conn.executemany(SQL_UPDATE_QUOTE, quote_updates)
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                logging.error(f"Failed to save notification state: {e}")
+                mark_watchlist_dirty()
+                return
+        # Keep the cached watchlist in step with what was just written
+        cached = watchlist['df']
+        cached.loc[hit_alert, ['alert_triggered', 'last_notified_alert']] = [1, current_time]
+        cached.loc[hit_target, 'last_notified_target'] = current_time
 
 # Schedule price checks
 def run_scheduler():
-    schedule.every(check_interval).minutes.do(check_prices)
+    # Fixed cadence off a monotonic deadline; overdue ticks coalesce
+    interval = check_interval * 60
+    deadline = time.monotonic()
     while True:
-        schedule.run_pending()
-        time.sleep(60)
+        try:
+            check_prices()
+        except Exception:
+            logging.exception("check_prices failed; scheduler continues")
+        deadline += interval
+        if deadline < time.monotonic():
+            deadline = time.monotonic()
+        time.sleep(max(0, deadline - time.monotonic()))
 
 # Start scheduler in background thread
 if 'scheduler_thread' not in st.session_state:
@@ -1,19 +1,24 @@
 import streamlit as st
 import sqlite3
 import pandas as pd
+import numpy as np
 import yfinance as yf
 import asyncio
 import telegram
+from telegram.request import HTTPXRequest
 import time
 import schedule
 import threading
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, time as dtime
 import pytz
 import logging
 import io
 import csv
 import json
+import requests
+from requests.adapters import HTTPAdapter
+from yfinance.data import YfData
 
 # Configure logging
 logging.basicConfig(
@@ -64,83 +69,285 @@ def init_db():
     c.execute('''CREATE TABLE IF NOT EXISTS strategies
                  (id TEXT PRIMARY KEY, name TEXT)''')
     
+    # Create table of the latest V20 range per symbol, refreshed daily
+    c.execute('''CREATE TABLE IF NOT EXISTS stock_ranges
+                 (symbol TEXT PRIMARY KEY, low REAL, high REAL, computed_at INTEGER)''')
+    
     # Create unique index to prevent duplicate stock-symbol-strategy combinations
     c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_symbol_strategy ON stocks (symbol, strategy)''')
     
+    # Partial index over the enabled rows the price checks scan
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_stocks_enabled_trig ON stocks (enabled, alert_triggered) WHERE enabled = 1''')
+    
     conn.commit()
     conn.close()
 
 # Initialize database
 init_db()
 
+# One connection for the UI, check_prices and the V20 refresh; writes take the db lock
+@st.cache_resource
+def get_conn():
+    conn = sqlite3.connect('stock_alerts.db', check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
+@st.cache_resource
+def get_db_lock():
+    return threading.Lock()
+
 # Telegram bot setup
 TELEGRAM_TOKEN = st.secrets["TELEGRAM_TOKEN"]
 CHAT_ID = st.secrets["CHAT_ID"]
-bot = telegram.Bot(token=TELEGRAM_TOKEN)
+# Pooled so queued messages can be in flight together
+bot = telegram.Bot(token=TELEGRAM_TOKEN, request=HTTPXRequest(connection_pool_size=8))
 
 # Price checking and notification logic
+# Sends run on the notifier loop, off the script thread, so failures are only logged
 async def send_telegram_message(message):
-    try:
-        await bot.send_message(chat_id=CHAT_ID, text=message)
-        logging.info(f"Sent Telegram message: {message}")
-    except Exception as e:
-        logging.error(f"Failed to send Telegram message: {e}")
-        st.error(f"Failed to send Telegram message: {e}")
+    while True:
+        try:
+            await bot.send_message(chat_id=CHAT_ID, text=message)
+            logging.info(f"Sent Telegram message: {message}")
+            return
+        except telegram.error.RetryAfter as e:
+            # Only this send backs off; the worker keeps dispatching the rest
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logging.error(f"Failed to send Telegram message: {e}")
+            return
 
-# Function to fetch current price and candlestick data using yfinance
-def get_stock_data(symbol):
-    try:
-        ticker = symbol.upper() if symbol.endswith('.NS') else f"{symbol.upper()}.NS"
-        stock = yf.Ticker(ticker)
-        
-        # Fetch current price
-        info = stock.info
-        current_price = info.get('regularMarketPrice', None)
-        if current_price is None:
-            logging.warning(f"No valid current price for {symbol}. Response: {info}")
-            return None, None
-        
-        # Fetch 1.5 years of daily candlestick data
-        hist = stock.history(period="1y2mo", interval="1d")
-        if hist.empty:
-            logging.warning(f"No historical data for {symbol}")
-            return current_price, None
-        
-        # Find the most recent V20 range (20% or more gain with green candles, momentum not broken by red)
-        v20_range = None
-        for i in range(len(hist) - 1, -1, -1):
-            current_candle = hist.iloc[i]
-            if current_candle['Close'] > current_candle['Open']:  # Green candle
-                for j in range(i - 1, -1, -1):
-                    prev_candle = hist.iloc[j]
-                    gain_percent = ((current_candle['High'] - prev_candle['Low']) / prev_candle['Low']) * 100
-                    if gain_percent >= 20:
-                        momentum_broken = False
-                        for k in range(j + 1, i + 1):
-                            if hist.iloc[k]['Close'] < hist.iloc[k]['Open']:  # Red candle
-                                momentum_broken = True
-                                break
-                        if not momentum_broken:
-                            v20_range = (prev_candle['Low'], current_candle['High'])
-                            break
-                if v20_range:
-                    break
-        
-        if not v20_range:
-            logging.warning(f"No V20 range found for {symbol}")
-            return current_price, None
-        
-        logging.info(f"Fetched data for {symbol}: Current price ₹{current_price:.2f}, V20 range low ₹{v20_range[0]:.2f}, high ₹{v20_range[1]:.2f}")
-        return current_price, v20_range
+# Telegram sends are drained by a long-lived event loop so callers never wait on them
+async def _notify_worker(queue):
+    interval = 1 / 30  # Telegram allows ~30 messages/second per bot
+    loop = asyncio.get_running_loop()
+    next_slot = 0.0
+    in_flight = set()
+    while True:
+        message = await queue.get()
+        await asyncio.sleep(max(0, next_slot - loop.time()))
+        next_slot = loop.time() + interval
+        task = loop.create_task(send_telegram_message(message))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+@st.cache_resource
+def get_notifier():
+    loop = asyncio.new_event_loop()
+    queue = asyncio.Queue()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(_notify_worker(queue), loop)
+    return loop, queue
+
+# Alerts from one tick joined into as few messages as Telegram's length limit allows,
+# splitting only between alerts
+TELEGRAM_MAX_LENGTH = 4096
+
+def batch_messages(messages):
+    batches, current = [], ""
+    for message in messages:
+        candidate = f"{current}\n{message}" if current else message
+        if len(candidate) <= TELEGRAM_MAX_LENGTH:
+            current = candidate
+        else:
+            if current:
+                batches.append(current)
+            current = message[:TELEGRAM_MAX_LENGTH]
+    if current:
+        batches.append(current)
+    return batches
+
+def enqueue_telegram_message(message):
+    loop, queue = get_notifier()
+    loop.call_soon_threadsafe(queue.put_nowait, message)
+
+# Yahoo requests time out instead of stalling a fetch (Ticker.info has no timeout of its own)
+YF_TIMEOUT = 10
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def send(self, request, **kwargs):
+        kwargs['timeout'] = kwargs.get('timeout') or YF_TIMEOUT
+        return super().send(request, **kwargs)
+
+# Yahoo responses are cached on disk when requests_cache is installed, so reruns and ticks
+# reuse them instead of re-downloading
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+# One session for every Yahoo call: yfinance shares a single session across tickers, so quote
+# and history lifetimes are set per URL. Quotes expire quickly; the V20 history is kept for hours.
+@st.cache_resource
+def get_yf_session():
+    if requests_cache is not None:
+        session = requests_cache.CachedSession('yf_cache', backend='sqlite', expire_after=timedelta(seconds=60),
+                                               urls_expire_after={'*/v8/finance/chart/*range=1y2mo*': timedelta(hours=6)},
+                                               allowable_methods=('GET', 'POST'))
+    else:
+        session = requests.Session()
+    adapter = TimeoutHTTPAdapter(pool_connections=8, pool_maxsize=8)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def to_ticker(symbol):
+    return symbol.upper() if symbol.endswith('.NS') else f"{symbol.upper()}.NS"
+
+# Ticker objects reused across history fetches and reruns. Not for .info: a Ticker keeps
+# its first info response, so price lookups build a fresh one.
+@st.cache_resource(max_entries=2048, show_spinner=False)
+def _ticker(ticker):
+    return yf.Ticker(ticker, session=get_yf_session())
+
+# Current price moves intraday, so it is only cached briefly
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_current_price(ticker):
+    info = yf.Ticker(ticker, session=get_yf_session()).info
+    current_price = info.get('regularMarketPrice', None)
+    if current_price is None:
+        logging.warning(f"No valid current price for {ticker}. Response: {info}")
+    return current_price
+
+# The V20 range comes from past daily candles, so it is cached for hours
+@st.cache_data(ttl=6 * 3600, show_spinner=False)
+def _fetch_v20_range(ticker):
+    # Fetch 1.5 years of daily candlestick data
+    hist = _ticker(ticker).history(period="1y2mo", interval="1d")
+    if hist.empty:
+        logging.warning(f"No historical data for {ticker}")
+        return None
     
-    except json.JSONDecodeError as e:
+    v20_range = detect_v20_range(hist)
+    if not v20_range:
+        logging.warning(f"No V20 range found for {ticker}")
+    return v20_range
+
+# Find the most recent V20 range (20% or more gain with green candles, momentum not broken by red).
+# ok[i, j]: green candle i gains 20% over the low of an earlier candle j with no red candle after j
+def detect_v20_range(hist):
+    o, h, l, c = hist[['Open', 'High', 'Low', 'Close']].to_numpy().T
+    idx = np.arange(len(c))
+    last_red = np.maximum.accumulate(np.where(c < o, idx, -1))
+    prev_red = np.concatenate(([-1], last_red[:-1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain_percent = (h[:, None] - l[None, :]) / l[None, :] * 100
+    ok = ((gain_percent >= 20) & (c > o)[:, None] &
+          (idx[None, :] < idx[:, None]) & (idx[None, :] >= prev_red[:, None]))
+    v20_range = None
+    green_ends = np.flatnonzero(ok.any(axis=1))
+    if green_ends.size:
+        i = green_ends[-1]
+        j = np.flatnonzero(ok[i])[-1]
+        v20_range = (l[j], h[i])
+    return v20_range
+
+# Fetch errors are reported here rather than inside the cached functions, so failures aren't cached
+def report_fetch_error(symbol, e):
+    if isinstance(e, json.JSONDecodeError):
         logging.error(f"JSON decode error for {symbol}: {e}")
         st.warning(f"Failed to fetch data for {symbol}: Invalid or empty response from Yahoo Finance.")
-        return None, None
-    except Exception as e:
+    else:
         logging.error(f"Error fetching data for {symbol}: {e}")
         st.warning(f"Error fetching data for {symbol}: {e}")
+
+def get_current_price(symbol):
+    try:
+        return _fetch_current_price(to_ticker(symbol))
+    except Exception as e:
+        report_fetch_error(symbol, e)
+        return None
+
+# Function to fetch current price and V20 range using yfinance
+def get_stock_data(symbol):
+    current_price = get_current_price(symbol)
+    if current_price is None:
         return None, None
+    v20_range = get_conn().execute("SELECT low, high FROM stock_ranges WHERE symbol = ? AND computed_at >= ?",
+                                   (symbol.upper(), int(time.time()) - V20_RANGE_MAX_AGE)).fetchone()
+    if v20_range is None:
+        try:
+            v20_range = _fetch_v20_range(to_ticker(symbol))
+        except Exception as e:
+            report_fetch_error(symbol, e)
+            return current_price, None
+        if v20_range:
+            store_v20_ranges({symbol.upper(): v20_range})
+    if v20_range:
+        logging.info(f"Fetched data for {symbol}: Current price ₹{current_price:.2f}, V20 range low ₹{v20_range[0]:.2f}, high ₹{v20_range[1]:.2f}")
+    return current_price, v20_range
+
+# V20 ranges are recomputed daily by the scheduler (and on first use) and read from
+# stock_ranges, so the price check never scans history
+V20_RANGE_MAX_AGE = 86400
+
+def store_v20_ranges(ranges):
+    now = int(time.time())
+    with get_db_lock():
+        get_conn().executemany("INSERT OR REPLACE INTO stock_ranges (symbol, low, high, computed_at) VALUES (?, ?, ?, ?)",
+                               [(symbol, float(low), float(high), now) for symbol, (low, high) in ranges.items()])
+
+# Every enabled symbol's history comes from one batched download, adjusted like Ticker.history
+def refresh_v20_ranges():
+    symbols = [row[0] for row in get_conn().execute("SELECT DISTINCT symbol FROM stocks WHERE enabled = 1")]
+    tickers = {symbol: to_ticker(symbol) for symbol in symbols}
+    if not tickers:
+        return
+    try:
+        data = yf.download(sorted(set(tickers.values())), period="1y2mo", interval="1d", auto_adjust=True,
+                           group_by='ticker', threads=True, progress=False)
+    except Exception as e:
+        logging.error(f"Batch history download failed for {len(tickers)} symbols: {e}")
+        return
+    ranges = {}
+    for symbol, ticker in tickers.items():
+        try:
+            hist = (data[ticker] if isinstance(data.columns, pd.MultiIndex) else data).dropna(subset=['Open', 'High', 'Low', 'Close'])
+        except KeyError:
+            continue
+        v20_range = detect_v20_range(hist) if not hist.empty else None
+        if v20_range:
+            ranges[symbol] = v20_range
+    store_v20_ranges(ranges)
+    logging.info(f"Refreshed V20 ranges for {len(ranges)} of {len(symbols)} symbols")
+
+YF_QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+
+# regularMarketPrice for up to 20 tickers per request from Yahoo's batch quote endpoint;
+# YfData adds the cookie and crumb the endpoint requires
+def fetch_prices_batch(tickers):
+    data = YfData(session=get_yf_session())
+    prices = {}
+    for start in range(0, len(tickers), 20):
+        chunk = tickers[start:start + 20]
+        try:
+            resp = data.get_raw_json(YF_QUOTE_URL, params={'symbols': ','.join(chunk), 'formatted': 'false'})
+            prices.update({r['symbol']: r.get('regularMarketPrice') for r in resp['quoteResponse']['result']})
+        except Exception as e:
+            logging.error(f"Batch quote failed for {','.join(chunk)}: {e}")
+    return prices
+
+# Current price for many symbols from batched quotes; symbols missing from the batch fall
+# back to a single-ticker fetch
+def get_current_prices(symbols):
+    tickers = {symbol: to_ticker(symbol) for symbol in symbols}
+    quotes = fetch_prices_batch(sorted(set(tickers.values())))
+    prices = {}
+    for symbol, ticker in tickers.items():
+        prices[symbol] = quotes.get(ticker)
+        if prices[symbol] is None:
+            prices[symbol] = get_current_price(symbol)
+    return prices
+
+# Enabled stocks as sqlite3.Row tuples for the alert checks; pandas is only used where a table is rendered
+def load_enabled_stocks():
+    cur = get_conn().cursor()
+    cur.row_factory = sqlite3.Row
+    return cur.execute("SELECT id, symbol, alert_price, target_price, alert_triggered, last_notified_alert, "
+                       "last_notified_target, notification_cooldown, created_at FROM stocks WHERE enabled = 1").fetchall()
 
 # Streamlit app
 st.title("V20 Stock Alert System")
@@ -153,19 +360,18 @@ default_cooldown = st.sidebar.number_input("Notification Cooldown (seconds)", mi
 # Manual notification button
 st.sidebar.subheader("Manual Actions")
 if st.sidebar.button("Send Manual Notification"):
-    conn = sqlite3.connect('stock_alerts.db')
-    df = pd.read_sql_query("SELECT * FROM stocks WHERE enabled = 1", conn)
-    conn.close()
+    rows = load_enabled_stocks()
     current_time = time.time()
-    for _, row in df.iterrows():
-        current_price, _ = get_stock_data(row['symbol'])
+    prices = get_current_prices([row['symbol'] for row in rows])
+    for row in rows:
+        current_price = prices[row['symbol']]
         if current_price:
             # Check V20 alert price (buy signal)
             if row['alert_price'] > 0 and row['alert_triggered'] == 0:
                 last_alert_time = row['last_notified_alert'] if row['last_notified_alert'] > 0 else row['created_at']
                 if current_time - last_alert_time >= row['notification_cooldown'] and current_price <= row['alert_price'] + 0.01:
                     message = f"🚨 V20 Buy Alert: {row['symbol']} hit buy price ₹{row['alert_price']:.2f}! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
+                    enqueue_telegram_message(message)
                     logging.info(f"Manual buy alert triggered for {row['symbol']} at ₹{current_price:.2f}")
 
             # Check target price (sell signal) only after alert is triggered
@@ -173,68 +379,58 @@ if st.sidebar.button("Send Manual Notification"):
                 last_target_time = row['last_notified_target'] if row['last_notified_target'] > 0 else row['created_at']
                 if current_time - last_target_time >= row['notification_cooldown'] and current_price >= row['target_price'] - 0.01:
                     message = f"🎯 V20 Sell Alert: {row['symbol']} hit target price ₹{row['target_price']:.2f}! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
+                    enqueue_telegram_message(message)
                     logging.info(f"Manual sell alert triggered for {row['symbol']} at ₹{current_price:.2f}")
 
 # Bulk actions in sidebar
 st.sidebar.subheader("Bulk Actions")
 if st.sidebar.button("Reset Alert Triggered for All Stocks"):
-    conn = sqlite3.connect('stock_alerts.db')
+    conn = get_conn()
     c = conn.cursor()
-    c.execute("UPDATE stocks SET alert_triggered = 0, last_notified_alert = 0")
-    conn.commit()
-    conn.close()
+    with get_db_lock():
+        c.execute("UPDATE stocks SET alert_triggered = 0, last_notified_alert = 0")
     st.sidebar.success("Alert triggered reset for all stocks!")
     logging.info("Reset alert triggered for all stocks")
     st.rerun()
 
+# Strategies rarely change; cached across reruns and cleared when one is added
+@st.cache_data(ttl=600, show_spinner=False)
+def load_strategies():
+    return [row[0] for row in get_conn().execute("SELECT name FROM strategies").fetchall()] or ["V20"]
+
 # Strategy management
 st.sidebar.subheader("Manage Strategies")
 new_strategy = st.sidebar.text_input("Add New Strategy")
 if st.sidebar.button("Add Strategy"):
     if new_strategy:
-        conn = sqlite3.connect('stock_alerts.db')
+        conn = get_conn()
         c = conn.cursor()
-        c.execute("INSERT INTO strategies (id, name) VALUES (?, ?)", (str(uuid.uuid4()), new_strategy))
-        conn.commit()
-        conn.close()
+        with get_db_lock():
+            c.execute("INSERT INTO strategies (id, name) VALUES (?, ?)", (str(uuid.uuid4()), new_strategy))
+        load_strategies.clear()
         st.sidebar.success(f"Strategy '{new_strategy}' added!")
         logging.info(f"Added strategy: {new_strategy}")
 
 # Load strategies
-conn = sqlite3.connect('stock_alerts.db')
-c = conn.cursor()
-c.execute("SELECT name FROM strategies")
-strategies = [row[0] for row in c.fetchall()]
-conn.close()
-if not strategies:
-    strategies = ["V20"]
+strategies = load_strategies()
 
 # Export stocks to CSV
 def export_stocks_to_csv():
-    conn = sqlite3.connect('stock_alerts.db')
+    conn = get_conn()
     df = pd.read_sql_query("SELECT * FROM stocks", conn)
-    conn.close()
-    
-    # Calculate days_to_target using original integer timestamps
-    df['days_to_target'] = df.apply(
-        lambda row: (datetime.fromtimestamp(row['last_notified_target'], tz=ist) - 
-                     datetime.fromtimestamp(row['last_notified_alert'], tz=ist)).days 
-        if (row['last_notified_alert'] > 0 and row['last_notified_target'] > 0) else 0, 
-        axis=1
-    )
     
-    # Convert timestamps to human-readable format after calculation
-    df['created_at'] = df['created_at'].apply(lambda x: datetime.fromtimestamp(x, tz=ist).strftime('%Y-%m-%d %H:%M:%S') if x > 0 else '')
-    df['last_notified_alert'] = df['last_notified_alert'].apply(lambda x: datetime.fromtimestamp(x, tz=ist).strftime('%Y-%m-%d %H:%M:%S') if x > 0 else '')
-    df['last_notified_target'] = df['last_notified_target'].apply(lambda x: datetime.fromtimestamp(x, tz=ist).strftime('%Y-%m-%d %H:%M:%S') if x > 0 else '')
+    # Calculate days_to_target using original integer timestamps, a whole column at a time
+    notified = (df['last_notified_alert'] > 0) & (df['last_notified_target'] > 0)
+    elapsed = pd.to_datetime(df['last_notified_target'], unit='s') - pd.to_datetime(df['last_notified_alert'], unit='s')
+    df['days_to_target'] = elapsed.dt.days.where(notified, 0).astype(int)
     
-    current_prices = {}
-    for _, row in df.iterrows():
-        current_price, _ = get_stock_data(row['symbol'])
-        current_prices[row['id']] = current_price if current_price else 0
+    # Convert timestamps to human-readable format after calculation (only created_at is exported)
+    mask = df['created_at'] > 0
+    formatted = pd.to_datetime(df['created_at'].where(mask), unit='s', utc=True).dt.tz_convert(ist).dt.strftime('%Y-%m-%d %H:%M:%S')
+    df['created_at'] = formatted.where(mask, '')
     
-    df['current_price'] = df['id'].map(current_prices)
+    prices = get_current_prices(df['symbol'].tolist())
+    df['current_price'] = df['symbol'].map(lambda symbol: prices[symbol] or 0)
     
     output = io.StringIO()
     df.to_csv(output, index=False, columns=['symbol', 'initial_price', 'alert_price', 'target_price', 'alert_triggered', 'created_at', 'current_price', 'days_to_target'])
@@ -262,7 +458,7 @@ with st.form(key="add_stock_form"):
     submit_button = st.form_submit_button("Add Stock")
 
     if submit_button and symbol:
-        conn = sqlite3.connect('stock_alerts.db')
+        conn = get_conn()
         c = conn.cursor()
         c.execute("SELECT id FROM stocks WHERE symbol = ? AND strategy = ?", (symbol.upper(), strategy))
         existing_stock = c.fetchone()
@@ -270,44 +466,46 @@ with st.form(key="add_stock_form"):
         if existing_stock:
             st.error(f"Stock {symbol.upper()} with strategy '{strategy}' already exists!")
             logging.warning(f"Attempted to add duplicate stock {symbol.upper()} with strategy {strategy}")
-            conn.close()
         else:
             current_price, v20_range = get_stock_data(symbol)
             if current_price is not None and v20_range:
                 alert_price, target_price = v20_range
                 created_at = int(time.time())
-                c.execute("""INSERT INTO stocks 
-                             (id, symbol, initial_price, alert_price, target_price, strategy, enabled, created_at, 
-                             alert_triggered, last_notified_alert, last_notified_target, notification_cooldown) 
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                         (str(uuid.uuid4()), symbol.upper(), current_price, alert_price, target_price, strategy, 1, 
-                          created_at, 0, 0, 0, default_cooldown))
-                conn.commit()
+                with get_db_lock():
+                    c.execute("""INSERT INTO stocks 
+                                 (id, symbol, initial_price, alert_price, target_price, strategy, enabled, created_at, 
+                                 alert_triggered, last_notified_alert, last_notified_target, notification_cooldown) 
+                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (str(uuid.uuid4()), symbol.upper(), current_price, alert_price, target_price, strategy, 1, 
+                              created_at, 0, 0, 0, default_cooldown))
                 st.success(f"Added {symbol.upper()} with V20 alert price ₹{alert_price:.2f} and target price ₹{target_price:.2f}")
                 logging.info(f"Added stock {symbol.upper()} with initial price ₹{current_price:.2f}, alert price ₹{alert_price:.2f}, target price ₹{target_price:.2f}, strategy {strategy}")
-                conn.close()
             else:
                 st.error(f"Invalid symbol {symbol.upper()}: No V20 range data available.")
                 logging.error(f"Failed to add stock {symbol.upper()}: No V20 range data")
-                conn.close()
 
 # Display and manage stocks
 st.subheader("Current Stock Alerts (V20 Strategy)")
-conn = sqlite3.connect('stock_alerts.db')
-df = pd.read_sql_query("SELECT * FROM stocks", conn)
-conn.close()
+conn = get_conn()
+df = pd.read_sql_query("SELECT s.*, r.low AS v20_low, r.high AS v20_high FROM stocks s "
+                       "LEFT JOIN stock_ranges r ON r.symbol = s.symbol", conn)
+
+# One batched quote for the whole list, reused across reruns for a minute
+@st.cache_data(ttl=60, show_spinner=False)
+def get_prices_map(symbols):
+    return get_current_prices(list(symbols))
 
 if not df.empty:
+    prices = get_prices_map(tuple(df['symbol']))
     for index, row in df.iterrows():
         with st.expander(f"{row['symbol']} - {row['strategy']}"):
             col1, col2, col3, col4 = st.columns(4)
             with col1:
                 if st.button("Delete", key=f"delete_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
+                    conn = get_conn()
                     c = conn.cursor()
-                    c.execute("DELETE FROM stocks WHERE id = ?", (row['id'],))
-                    conn.commit()
-                    conn.close()
+                    with get_db_lock():
+                        c.execute("DELETE FROM stocks WHERE id = ?", (row['id'],))
                     st.rerun()
                     logging.info(f"Deleted stock {row['symbol']}")
             with col2:
@@ -315,12 +513,11 @@ if not df.empty:
                     st.session_state[f"edit_mode_{row['id']}"] = True
             with col3:
                 if st.button("Disable/Enable", key=f"toggle_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
+                    conn = get_conn()
                     c = conn.cursor()
                     new_status = 0 if row['enabled'] else 1
-                    c.execute("UPDATE stocks SET enabled = ? WHERE id = ?", (new_status, row['id']))
-                    conn.commit()
-                    conn.close()
+                    with get_db_lock():
+                        c.execute("UPDATE stocks SET enabled = ? WHERE id = ?", (new_status, row['id']))
                     st.rerun()
                     logging.info(f"{'Enabled' if new_status else 'Disabled'} stock {row['symbol']}")
             with col4:
@@ -334,15 +531,14 @@ if not df.empty:
                     with col2:
                         new_target_price = st.number_input("New Target Price (V20 High)", value=float(row['target_price']), key=f"target_{row['id']}")
                     if st.form_submit_button("Save Changes"):
-                        conn = sqlite3.connect('stock_alerts.db')
+                        conn = get_conn()
                         c = conn.cursor()
-                        c.execute("UPDATE stocks SET alert_price = ?, target_price = ? WHERE id = ?",
-                                 (new_alert_price, new_target_price, row['id']))
-                        conn.commit()
+                        with get_db_lock():
+                            c.execute("UPDATE stocks SET alert_price = ?, target_price = ? WHERE id = ?",
+                                     (new_alert_price, new_target_price, row['id']))
                         st.session_state[f"edit_mode_{row['id']}"] = False
                         st.rerun()
                         logging.info(f"Updated stock {row['symbol']} with new alert price ₹{new_alert_price:.2f}, target price ₹{new_target_price:.2f}")
-                        conn.close()
 
             st.write(f"Initial Price: ₹{row['initial_price']:.2f}")
             st.write(f"V20 Alert Price: ₹{row['alert_price']:.2f}")
@@ -350,67 +546,125 @@ if not df.empty:
             st.write(f"Alert Triggered: {'Yes' if row['alert_triggered'] else 'No'}")
             created_at = datetime.fromtimestamp(row['created_at'], tz=ist).strftime('%Y-%m-%d %H:%M:%S') if row['created_at'] > 0 else 'N/A'
             st.write(f"Created At: {created_at}")
-            current_price, _ = get_stock_data(row['symbol'])
+            if pd.notna(row['v20_low']):
+                st.write(f"Latest V20 Range: ₹{row['v20_low']:.2f} - ₹{row['v20_high']:.2f}")
+            current_price = prices.get(row['symbol'])
             if current_price:
                 st.write(f"Current Price: ₹{current_price:.2f}")
             else:
                 st.write("Current Price: Unavailable")
 
+# NSE trading hours; market holidays (YYYY-MM-DD) can be listed under NSE_HOLIDAYS in secrets
+MARKET_OPEN = dtime(9, 15)
+MARKET_CLOSE = dtime(15, 30)
+NSE_HOLIDAYS = set(st.secrets.get("NSE_HOLIDAYS", []))
+
+def is_market_open(now=None):
+    now = now or datetime.now(ist)
+    return (now.weekday() < 5 and now.strftime('%Y-%m-%d') not in NSE_HOLIDAYS
+            and MARKET_OPEN <= now.time() <= MARKET_CLOSE)
+
+def seconds_until_open(now=None):
+    now = now or datetime.now(ist)
+    open_at = now.replace(hour=MARKET_OPEN.hour, minute=MARKET_OPEN.minute, second=0, microsecond=0)
+    if open_at <= now:
+        open_at += timedelta(days=1)
+    return (open_at - now).total_seconds()
+
+# Fireable alerts for this tick, evaluated by SQLite against the prices in tmp_price. just_added
+# rows (added within the last minute with the price already at the alert) are skipped.
+SQL_FIREABLE = """SELECT * FROM (
+    SELECT s.id, s.symbol, s.alert_price, s.target_price, p.price,
+           (:now - s.created_at < 60 AND s.alert_triggered = 0
+            AND ABS(p.price - s.alert_price) / s.alert_price <= 0.01) AS just_added,
+           (s.alert_price > 0 AND s.alert_triggered = 0 AND p.price <= s.alert_price + 0.01
+            AND :now - COALESCE(NULLIF(s.last_notified_alert, 0), s.created_at) >= s.notification_cooldown) AS buy,
+           (s.target_price > 0 AND s.alert_triggered = 1 AND p.price >= s.target_price - 0.01
+            AND :now - COALESCE(NULLIF(s.last_notified_target, 0), s.created_at) >= s.notification_cooldown) AS sell
+    FROM stocks s JOIN tmp_price p USING (id)
+    WHERE s.enabled = 1)
+WHERE just_added OR buy OR sell"""
+
 def check_prices():
-    conn = sqlite3.connect('stock_alerts.db')
-    df = pd.read_sql_query("SELECT * FROM stocks WHERE enabled = 1", conn)
-    conn.close()
+    # Quotes don't move outside trading hours, so skip the fetch entirely
+    if not is_market_open():
+        return
+    conn = get_conn()
+    stocks = conn.execute("SELECT id, symbol FROM stocks WHERE enabled = 1").fetchall()
 
     current_time = time.time()
+    prices = get_current_prices([symbol for _, symbol in stocks])
+    alerts_this_tick = []
+    alert_updates = []
+    target_updates = []
 
-    for _, row in df.iterrows():
-        try:
-            current_price, _ = get_stock_data(row['symbol'])
-            if current_price is None:
-                continue
+    # Upload this tick's prices and let SQLite pick the rows that fire
+    with get_db_lock():
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS tmp_price (id TEXT PRIMARY KEY, price REAL)")
+        conn.execute("DELETE FROM tmp_price")
+        conn.executemany("INSERT INTO tmp_price (id, price) VALUES (?, ?)",
+                         [(stock_id, prices[symbol]) for stock_id, symbol in stocks if prices.get(symbol) is not None])
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        hits = cur.execute(SQL_FIREABLE, {'now': current_time}).fetchall()
 
-            # Skip notifications if stock was just added and price is already at/beyond alert price
-            if current_time - row['created_at'] < 60 and row['alert_triggered'] == 0:
-                if abs(current_price - row['alert_price']) / row['alert_price'] <= 0.01:
-                    logging.info(f"Skipping initial alert notification for {row['symbol']} as price is already at/beyond V20 alert price")
-                    continue
+    for row in hits:
+        current_price = row['price']
+        if row['just_added']:
+            logging.info(f"Skipping initial alert notification for {row['symbol']} as price is already at/beyond V20 alert price")
+            continue
 
-            # Check V20 alert price (buy signal)
-            if row['alert_price'] > 0 and row['alert_triggered'] == 0:
-                last_alert_time = row['last_notified_alert'] if row['last_notified_alert'] > 0 else row['created_at']
-                if current_time - last_alert_time >= row['notification_cooldown'] and current_price <= row['alert_price'] + 0.01:
-                    message = f"🚨 V20 Buy Alert: {row['symbol']} hit buy price ₹{row['alert_price']:.2f}! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    c.execute("UPDATE stocks SET alert_triggered = 1, last_notified_alert = ? WHERE id = ?", (current_time, row['id']))
-                    conn.commit()
-                    conn.close()
-                    logging.info(f"Buy alert triggered for {row['symbol']} at ₹{current_price:.2f}")
+        # V20 alert price (buy signal)
+        if row['buy']:
+            alerts_this_tick.append(f"🚨 V20 Buy Alert: {row['symbol']} hit buy price ₹{row['alert_price']:.2f}! Current: ₹{current_price:.2f}")
+            alert_updates.append((current_time, row['id']))
+            logging.info(f"Buy alert triggered for {row['symbol']} at ₹{current_price:.2f}")
 
-            # Check target price (sell signal) only after alert is triggered
-            if row['target_price'] > 0 and row['alert_triggered'] == 1:
-                last_target_time = row['last_notified_target'] if row['last_notified_target'] > 0 else row['created_at']
-                if current_time - last_target_time >= row['notification_cooldown'] and current_price >= row['target_price'] - 0.01:
-                    message = f"🎯 V20 Sell Alert: {row['symbol']} hit target price ₹{row['target_price']:.2f}! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    c.execute("UPDATE stocks SET last_notified_target = ? WHERE id = ?", (current_time, row['id']))
-                    conn.commit()
-                    conn.close()
-                    logging.info(f"Sell alert triggered for {row['symbol']} at ₹{current_price:.2f}")
+        # Target price (sell signal) only after alert is triggered
+        if row['sell']:
+            alerts_this_tick.append(f"🎯 V20 Sell Alert: {row['symbol']} hit target price ₹{row['target_price']:.2f}! Current: ₹{current_price:.2f}")
+            target_updates.append((current_time, row['id']))
+            logging.info(f"Sell alert triggered for {row['symbol']} at ₹{current_price:.2f}")
 
-        except Exception as e:
-            logging.error(f"Error checking {row['symbol']}: {e}")
-            st.error(f"Error checking {row['symbol']}: {e}")
+    # Write all notification state for this tick in one transaction
+    if alert_updates or target_updates:
+        with get_db_lock():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("UPDATE stocks SET alert_triggered = 1, last_notified_alert = ? WHERE id = ?", alert_updates)
+                conn.executemany("UPDATE stocks SET last_notified_target = ? WHERE id = ?", target_updates)
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                # Nothing is sent, so these alerts fire again on the next tick
+                logging.error(f"Failed to save notification state: {e}")
+                return
+
+    # One message per tick instead of one per alert
+    for message in batch_messages(alerts_this_tick):
+        enqueue_telegram_message(message)
 
 # Schedule price checks
+# Jobs log their own failures; a raising job would kill the thread and never be rescheduled
+def run_logged(job):
+    try:
+        job()
+    except Exception:
+        logging.exception(f"{job.__name__} failed")
+
 def run_scheduler():
-    schedule.every(check_interval).minutes.do(check_prices)
+    run_logged(refresh_v20_ranges)
+    schedule.every().day.at("09:20", "Asia/Kolkata").do(run_logged, refresh_v20_ranges)
+    schedule.every(check_interval).minutes.do(run_logged, check_prices)
     while True:
-        schedule.run_pending()
-        time.sleep(60)
+        try:
+            schedule.run_pending()
+        except Exception:
+            logging.exception("Scheduler poll failed")
+        # Poll every minute while the market is open; otherwise wake for the next job or
+        # the open, whichever is sooner, at most 10 minutes out
+        delay = 60 if is_market_open() else min(600, schedule.idle_seconds(), seconds_until_open())
+        time.sleep(max(0, delay))
 
 # Start scheduler in background thread
 if 'scheduler_thread' not in st.session_state:
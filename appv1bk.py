@@ -6,25 +6,85 @@ import asyncio
 import telegram
 import time
 from datetime import datetime
-import schedule
 import threading
 import uuid
+import logging
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from telegram.request import HTTPXRequest
+
+# SQL statements, shared by every call site so each connection's statement cache hits
+SQL_SELECT_STRATEGIES = "SELECT name FROM strategies"
+SQL_INSERT_STRATEGY = "INSERT INTO strategies (id, name) VALUES (?, ?)"
+SQL_SELECT_STOCKS = "SELECT * FROM stocks"
+SQL_SELECT_ENABLED_STOCKS = ("SELECT id, symbol, alert_price, target_price, last_notified_alert, last_notified_target "
+                             "FROM stocks WHERE enabled = 1")
+SQL_INSERT_STOCK = ("INSERT INTO stocks (id, symbol, alert_price, target_price, strategy, enabled, last_notified_alert, last_notified_target) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+SQL_DELETE_STOCK = "DELETE FROM stocks WHERE id = ?"
+SQL_UPDATE_STOCK = "UPDATE stocks SET alert_price = ?, target_price = ?, strategy = ?, enabled = ? WHERE id = ?"
+SQL_UPDATE_NOTIFIED = ("UPDATE stocks SET last_notified_alert = COALESCE(?, last_notified_alert), "
+                       "last_notified_target = COALESCE(?, last_notified_target) WHERE id = ?")
 
 # Database setup
 def init_db():
     conn = sqlite3.connect('stock_alerts.db')
     c = conn.cursor()
+    # WAL lets the scheduler thread write while the UI thread reads
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA busy_timeout=5000")
+    c.execute("PRAGMA temp_store=MEMORY")
+    c.execute("PRAGMA cache_size=-20000")
     c.execute('''CREATE TABLE IF NOT EXISTS stocks
                  (id TEXT PRIMARY KEY, symbol TEXT, alert_price REAL, target_price REAL, 
                   strategy TEXT, enabled INTEGER, last_notified_alert REAL, last_notified_target REAL)''')
     c.execute('''CREATE TABLE IF NOT EXISTS strategies
                  (id TEXT PRIMARY KEY, name TEXT)''')
+    # Partial index for the scheduler's enabled-only scan, plus symbol lookups
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stocks_enabled ON stocks(enabled) WHERE enabled = 1")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stocks_symbol ON stocks(symbol)")
     conn.commit()
     conn.close()
 
 # Initialize database
 init_db()
 
+# Reads use one read-only connection per thread; under WAL they never block the writer
+_tls = threading.local()
+def get_conn():
+    if not hasattr(_tls, 'conn'):
+        _tls.conn = sqlite3.connect('file:stock_alerts.db?mode=ro', uri=True, check_same_thread=False)
+        _tls.conn.execute("PRAGMA busy_timeout=5000")
+    return _tls.conn
+
+# All writes go through a single process-wide autocommit connection, serialised by its lock
+@st.cache_resource
+def get_writer():
+    conn = sqlite3.connect('stock_alerts.db', check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn, threading.Lock()
+
+def execute_write(sql, params=()):
+    conn, lock = get_writer()
+    with lock:
+        conn.execute(sql, params)
+
+def execute_write_batches(batches):
+    # [(sql, rows), ...] applied with executemany in one transaction
+    conn, lock = get_writer()
+    with lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, rows in batches:
+                conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
 # Telegram bot setup
 # TELEGRAM_TOKEN = st.secrets.get("TELEGRAM_TOKEN", "7826437102:AAFdVAv7b0go3wOcPLNMZMVAfRM8O2SX3xQ")
 # CHAT_ID = st.secrets.get("CHAT_ID", "542581131")
@@ -32,7 +92,47 @@ init_db()
 
 TELEGRAM_TOKEN = st.secrets["TELEGRAM_TOKEN"]
 CHAT_ID = st.secrets["CHAT_ID"]
-bot = telegram.Bot(token=TELEGRAM_TOKEN)
+# Pool sized so a sweep's messages can be in flight together
+bot = telegram.Bot(token=TELEGRAM_TOKEN, request=HTTPXRequest(connection_pool_size=8))
+
+# Shared Yahoo session: pooled keep-alive connections, retries on throttling/5xx
+@st.cache_resource
+def get_yf_session():
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"})
+    return session
+
+# One batched download for every symbol (two days, so an empty current-day bar falls back
+# to the previous close); memoized per minute so reruns reuse it
+@st.cache_data(ttl=60, show_spinner=False)
+def download_closes(symbols, minute_bucket):
+    data = yf.download(list(symbols), period="2d", progress=False, threads=True, group_by="ticker",
+                       session=get_yf_session())
+    closes = {}
+    for symbol in symbols:
+        try:
+            frame = data[symbol] if isinstance(data.columns, pd.MultiIndex) else data
+            close = frame['Close'].dropna()
+            if not close.empty:
+                closes[symbol] = float(close.iloc[-1])
+        except KeyError:
+            pass
+    return closes
+
+def get_current_prices(symbols):
+    return download_closes(tuple(sorted(set(symbols))), int(time.time() // 60))
+
+# Add-form validation; a one-day history is far lighter than .info and repeat symbols hit the cache
+@st.cache_data(ttl=3600, show_spinner=False)
+def is_valid_ticker(symbol):
+    try:
+        return not yf.Ticker(symbol, session=get_yf_session()).history(period="1d").empty
+    except Exception:
+        return False
 
 # Streamlit app
 st.title("Stock Alert System")
@@ -41,24 +141,26 @@ st.title("Stock Alert System")
 st.sidebar.header("Configuration")
 check_interval = st.sidebar.slider("Price Check Interval (minutes)", 1, 60, 5)
 
+# DB reads are cached across reruns; every UI write clears the matching cache
+@st.cache_data(ttl=60, show_spinner=False)
+def load_strategies():
+    return [row[0] for row in get_conn().execute(SQL_SELECT_STRATEGIES).fetchall()]
+
+@st.cache_data(ttl=10, show_spinner=False)
+def load_stocks():
+    return pd.read_sql_query(SQL_SELECT_STOCKS, get_conn())
+
 # Strategy management
 st.sidebar.subheader("Manage Strategies")
 new_strategy = st.sidebar.text_input("Add New Strategy")
 if st.sidebar.button("Add Strategy"):
     if new_strategy:
-        conn = sqlite3.connect('stock_alerts.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO strategies (id, name) VALUES (?, ?)", (str(uuid.uuid4()), new_strategy))
-        conn.commit()
-        conn.close()
+        execute_write(SQL_INSERT_STRATEGY, (str(uuid.uuid4()), new_strategy))
+        load_strategies.clear()
         st.sidebar.success(f"Strategy '{new_strategy}' added!")
 
 # Load strategies
-conn = sqlite3.connect('stock_alerts.db')
-c = conn.cursor()
-c.execute("SELECT name FROM strategies")
-strategies = [row[0] for row in c.fetchall()]
-conn.close()
+strategies = load_strategies()
 if not strategies:
     strategies = ["Buy", "Sell", "Hold"]
 
@@ -77,126 +179,182 @@ with st.form(key="add_stock_form"):
     submit_button = st.form_submit_button("Add Stock")
 
     if submit_button and symbol:
-        conn = sqlite3.connect('stock_alerts.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO stocks (id, symbol, alert_price, target_price, strategy, enabled, last_notified_alert, last_notified_target) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                 (str(uuid.uuid4()), symbol.upper(), alert_price, target_price, strategy, 1, 0, 0))
-        conn.commit()
-        conn.close()
-        st.success(f"Added {symbol.upper()} to alerts!")
+        if not is_valid_ticker(symbol.upper()):
+            st.error(f"Invalid symbol {symbol.upper()}: No price data available")
+        else:
+            execute_write(SQL_INSERT_STOCK,
+                          (str(uuid.uuid4()), symbol.upper(), alert_price, target_price, strategy, 1, 0, 0))
+            load_stocks.clear()
+            st.success(f"Added {symbol.upper()} to alerts!")
 
 # Display and manage stocks
 st.subheader("Current Stock Alerts")
-conn = sqlite3.connect('stock_alerts.db')
-df = pd.read_sql_query("SELECT * FROM stocks", conn)
-conn.close()
+df = load_stocks()
+
+if 'editor_rev' not in st.session_state:
+    st.session_state.editor_rev = 0
 
 if not df.empty:
-    for index, row in df.iterrows():
-        with st.expander(f"{row['symbol']} - {row['strategy']}"):
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                if st.button("Delete", key=f"delete_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    c.execute("DELETE FROM stocks WHERE id = ?", (row['id'],))
-                    conn.commit()
-                    conn.close()
-                    st.experimental_rerun()
-            with col2:
-                if st.button("Edit", key=f"edit_{row['id']}"):
-                    st.session_state[f"edit_mode_{row['id']}"] = True
-            with col3:
-                if st.button("Disable/Enable", key=f"toggle_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    new_status = 0 if row['enabled'] else 1
-                    c.execute("UPDATE stocks SET enabled = ? WHERE id = ?", (new_status, row['id']))
-                    conn.commit()
-                    conn.close()
-                    st.experimental_rerun()
-            with col4:
-                st.write(f"Enabled: {'Yes' if row['enabled'] else 'No'}")
-
-            if st.session_state.get(f"edit_mode_{row['id']}", False):
-                with st.form(key=f"edit_form_{row['id']}"):
-                    ecol1, ecol2, ecol3 = st.columns(3)
-                    with ecol1:
-                        new_alert_price = st.number_input("New Alert Price", value=float(row['alert_price']), key=f"alert_{row['id']}")
-                    with ecol2:
-                        new_target_price = st.number_input("New Target Price", value=float(row['target_price']), key=f"target_{row['id']}")
-                    with ecol3:
-                        new_strategy = st.selectbox("New Strategy", strategies, index=strategies.index(row['strategy']), key=f"strat_{row['id']}")
-                    if st.form_submit_button("Save Changes"):
-                        conn = sqlite3.connect('stock_alerts.db')
-                        c = conn.cursor()
-                        c.execute("UPDATE stocks SET alert_price = ?, target_price = ?, strategy = ? WHERE id = ?",
-                                 (new_alert_price, new_target_price, new_strategy, row['id']))
-                        conn.commit()
-                        conn.close()
-                        st.session_state[f"edit_mode_{row['id']}"] = False
-                        st.experimental_rerun()
-
-            st.write(f"Alert Price: ${row['alert_price']:.2f}")
-            st.write(f"Target Price: ${row['target_price']:.2f}")
-            try:
-                stock = yf.Ticker(row['symbol'])
-                current_price = stock.history(period="1d")['Close'].iloc[-1]
-                st.write(f"Current Price: ${current_price:.2f}")
-            except:
-                st.write("Current Price: Unavailable")
+    # One editable grid instead of an expander per row; saved edits are diffed against df
+    grid = df[['id', 'symbol', 'strategy', 'alert_price', 'target_price', 'enabled']].copy()
+    grid['enabled'] = grid['enabled'].astype(bool)
+    grid['current_price'] = grid['symbol'].map(get_current_prices(grid['symbol'].tolist()))
+    grid['delete'] = False
+    with st.form(key="stocks_editor_form"):
+        edited = st.data_editor(
+            grid,
+            key=f"stocks_editor_{st.session_state.editor_rev}",
+            hide_index=True,
+            column_config={
+                "id": None,
+                "symbol": st.column_config.TextColumn("Symbol", disabled=True),
+                "strategy": st.column_config.SelectboxColumn("Strategy", options=strategies, required=True),
+                "alert_price": st.column_config.NumberColumn("Alert Price", min_value=0.0, step=0.01, format="$%.2f"),
+                "target_price": st.column_config.NumberColumn("Target Price", min_value=0.0, step=0.01, format="$%.2f"),
+                "enabled": st.column_config.CheckboxColumn("Enabled"),
+                "current_price": st.column_config.NumberColumn("Current Price", format="$%.2f", disabled=True),
+                "delete": st.column_config.CheckboxColumn("Delete"),
+            },
+        )
+        if st.form_submit_button("Save Changes"):
+            edit_columns = ['strategy', 'alert_price', 'target_price', 'enabled']
+            deleted = edited.loc[edited['delete'], 'id']
+            kept = edited[~edited['delete']].set_index('id')
+            original = grid.set_index('id').loc[kept.index]
+            changed = kept[(kept[edit_columns] != original[edit_columns]).any(axis=1)]
+            execute_write_batches([
+                (SQL_DELETE_STOCK, [(stock_id,) for stock_id in deleted]),
+                (SQL_UPDATE_STOCK, [(row.alert_price, row.target_price, row.strategy, int(row.enabled), row.Index)
+                                    for row in changed.itertuples()]),
+            ])
+            load_stocks.clear()
+            st.session_state.editor_rev += 1
+            st.rerun()
 
 # Price checking and notification logic
+# check_prices and the notifier run off the script thread, where st.* calls don't render;
+# their errors are logged and kept in a small ring that the sidebar shows on each run
+log = logging.getLogger("alerts")
+
+@st.cache_resource
+def get_error_log():
+    return deque(maxlen=50), threading.Lock()
+
+def record_error(message, exc_info=False):
+    log.error(message, exc_info=exc_info)
+    errors, lock = get_error_log()
+    with lock:
+        errors.append(f"{datetime.now():%Y-%m-%d %H:%M:%S} {message}")
+
 async def send_telegram_message(message):
-    try:
-        await bot.send_message(chat_id=CHAT_ID, text=message)
-    except Exception as e:
-        st.error(f"Failed to send Telegram message: {e}")
+    while True:
+        try:
+            await bot.send_message(chat_id=CHAT_ID, text=message)
+            return
+        except telegram.error.RetryAfter as e:
+            # Only this send backs off; the worker keeps dispatching the rest
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            record_error(f"Failed to send Telegram message: {e}")
+            return
+
+# Telegram sends are drained by a long-lived event loop so check_prices never waits on them
+async def _notify_worker(queue):
+    interval = 1 / 30  # Telegram allows ~30 messages/second per bot
+    loop = asyncio.get_running_loop()
+    next_slot = 0.0
+    in_flight = set()
+    while True:
+        message = await queue.get()
+        await asyncio.sleep(max(0, next_slot - loop.time()))
+        next_slot = loop.time() + interval
+        task = loop.create_task(send_telegram_message(message))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+@st.cache_resource
+def get_notifier():
+    loop = asyncio.new_event_loop()
+    queue = asyncio.Queue()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(_notify_worker(queue), loop)
+    return loop, queue
+
+def enqueue_telegram_message(message):
+    loop, queue = get_notifier()
+    loop.call_soon_threadsafe(queue.put_nowait, message)
 
 def check_prices():
-    conn = sqlite3.connect('stock_alerts.db')
-    df = pd.read_sql_query("SELECT * FROM stocks WHERE enabled = 1", conn)
-    conn.close()
+    # Plain tuples straight into a frame; only the columns the masks need
+    cursor = get_conn().execute(SQL_SELECT_ENABLED_STOCKS)
+    df = pd.DataFrame(cursor.fetchall(), columns=[d[0] for d in cursor.description])
+    if df.empty:
+        return
+    prices = get_current_prices(df['symbol'].tolist())
 
-    for _, row in df.iterrows():
-        try:
-            stock = yf.Ticker(row['symbol'])
-            current_price = stock.history(period="1d")['Close'].iloc[-1]
-            current_time = time.time()
-
-            # Check alert price
-            if (row['alert_price'] > 0 and 
-                ((current_price <= row['alert_price'] and current_price < row['last_notified_alert']) or 
-                 (current_price >= row['alert_price'] and current_price > row['last_notified_alert']))):
-                message = f"🚨 Alert: {row['symbol']} hit alert price ${row['alert_price']:.2f}! Current: ${current_price:.2f}"
-                asyncio.run(send_telegram_message(message))
-                conn = sqlite3.connect('stock_alerts.db')
-                c = conn.cursor()
-                c.execute("UPDATE stocks SET last_notified_alert = ? WHERE id = ?", (current_price, row['id']))
-                conn.commit()
-                conn.close()
-
-            # Check target price
-            if (row['target_price'] > 0 and 
-                ((current_price <= row['target_price'] and current_price < row['last_notified_target']) or 
-                 (current_price >= row['target_price'] and current_price > row['last_notified_target']))):
-                message = f"🎯 Target: {row['symbol']} hit target price ${row['target_price']:.2f}! Current: ${current_price:.2f}"
-                asyncio.run(send_telegram_message(message))
-                conn = sqlite3.connect('stock_alerts.db')
-                c = conn.cursor()
-                c.execute("UPDATE stocks SET last_notified_target = ? WHERE id = ?", (current_price, row['id']))
-                conn.commit()
-                conn.close()
+    # Evaluate both triggers as column masks, then only visit the rows that hit
+    df['current_price'] = df['symbol'].map(prices).astype(float)
+    price, alert_price, target_price = df['current_price'], df['alert_price'], df['target_price']
+    last_alert, last_target = df['last_notified_alert'], df['last_notified_target']
+    for symbol in df.loc[price.isna(), 'symbol']:
+        record_error(f"Error checking {symbol}: no price data")
+    alert_hit = ((alert_price > 0) &
+                 (((price <= alert_price) & (price < last_alert)) | ((price >= alert_price) & (price > last_alert))))
+    target_hit = ((target_price > 0) &
+                  (((price <= target_price) & (price < last_target)) | ((price >= target_price) & (price > last_target))))
+    # Pack both hits into one bitmask per row: 1 = alert, 2 = target
+    df['hit_mask'] = alert_hit.astype('uint8') | (target_hit.astype('uint8') * 2)
+    hits = df[df['hit_mask'] > 0]
 
-        except Exception as e:
-            st.error(f"Error checking {row['symbol']}: {e}")
+    for row in hits.itertuples():
+        if row.hit_mask & 1:
+            enqueue_telegram_message(f"🚨 Alert: {row.symbol} hit alert price ${row.alert_price:.2f}! Current: ${row.current_price:.2f}")
+        if row.hit_mask & 2:
+            enqueue_telegram_message(f"🎯 Target: {row.symbol} hit target price ${row.target_price:.2f}! Current: ${row.current_price:.2f}")
+
+    # (alert, target, id) per notified row, built column-wise; None leaves that column unchanged
+    notified = hits['current_price'].astype(object)
+    updates = list(zip(notified.where((hits['hit_mask'] & 1) > 0, None),
+                       notified.where((hits['hit_mask'] & 2) > 0, None),
+                       hits['id']))
+
+    # Write all notification state for this tick in one transaction, one UPDATE per row
+    if updates:
+        writer, lock = get_writer()
+        with lock:
+            try:
+                writer.execute("BEGIN IMMEDIATE")
+                writer.executemany(SQL_UPDATE_NOTIFIED, updates)
+                writer.execute("COMMIT")
+            except Exception as e:
+                if writer.in_transaction:
+                    writer.execute("ROLLBACK")
+                record_error(f"Failed to save notification state: {e}", exc_info=True)
 
 # Schedule price checks
 def run_scheduler():
-    schedule.every(check_interval).minutes.do(check_prices)
+    # Deadline-based, so a slow check doesn't push later ticks back
+    interval = check_interval * 60
+    deadline = time.monotonic()
     while True:
-        schedule.run_pending()
-        time.sleep(60)
+        # One failed tick must not end the scheduler thread; the error goes to the sidebar ring
+        try:
+            check_prices()
+        except Exception as e:
+            record_error(f"Price check failed: {e}", exc_info=True)
+        deadline += interval
+        if deadline < time.monotonic():
+            deadline = time.monotonic()
+        time.sleep(max(0, deadline - time.monotonic()))
+
+# Show recent background errors
+errors, errors_lock = get_error_log()
+with errors_lock:
+    recent_errors = list(errors)[-10:]
+if recent_errors:
+    st.sidebar.subheader("Recent Errors")
+    for error in reversed(recent_errors):
+        st.sidebar.text(error)
 
 # Start scheduler in background thread
 if 'scheduler_thread' not in st.session_state:
@@ -1,15 +1,23 @@
 import streamlit as st
 import sqlite3
 import requests
+import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import asyncio
 import telegram
+from telegram.request import HTTPXRequest
 import time
-import schedule
 import threading
 import uuid
 from datetime import datetime
+from collections import namedtuple
 import pytz
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from cache import TTLCache
+from ratelimit import TokenBucket
 
 # Set timezone to IST
 ist = pytz.timezone('Asia/Kolkata')
@@ -20,22 +28,57 @@ def init_db():
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS stocks
                  (id TEXT PRIMARY KEY, symbol TEXT, alert_price REAL, target_price REAL, 
-                  strategy TEXT, enabled INTEGER, last_notified_alert REAL, last_notified_target REAL)''')
+                  strategy TEXT, enabled INTEGER, last_notified_alert REAL, last_notified_target REAL, nse_symbol TEXT)''')
+    # NSE symbol (upper case, no .NS suffix) stored once so price lookups skip normalising
+    c.execute("PRAGMA table_info(stocks)")
+    if 'nse_symbol' not in [info[1] for info in c.fetchall()]:
+        c.execute("ALTER TABLE stocks ADD COLUMN nse_symbol TEXT")
+    c.execute("UPDATE stocks SET nse_symbol = REPLACE(UPPER(symbol), '.NS', '') WHERE nse_symbol IS NULL")
     c.execute('''CREATE TABLE IF NOT EXISTS strategies
                  (id TEXT PRIMARY KEY, name TEXT)''')
+    # Partial index over the enabled rows check_prices scans, covering every column it reads
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_stocks_check_cover ON stocks
+                 (enabled, id, symbol, nse_symbol, alert_price, target_price, last_notified_alert, last_notified_target)
+                 WHERE enabled = 1''')
+    try:
+        c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_symbol_strategy ON stocks (symbol, strategy)''')
+    except sqlite3.IntegrityError:
+        st.warning("Duplicate symbol/strategy rows exist; remove them to enable the unique index")
     conn.commit()
     conn.close()
 
 # Initialize database
 init_db()
 
+# Process-wide autocommit connection; writers hold get_db_lock()
+@st.cache_resource
+def get_conn():
+    conn = sqlite3.connect('stock_alerts.db', check_same_thread=False, isolation_level=None, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
+    return conn
+
+# Hot-path SQL kept as constants so each run reuses the compiled statement from the cache
+_SQL_ENABLED_STOCKS = ("SELECT id, symbol, nse_symbol, alert_price, target_price, last_notified_alert, last_notified_target "
+                       "FROM stocks WHERE enabled = 1")
+_SQL_UPDATE_ALERT = "UPDATE stocks SET last_notified_alert = ? WHERE id = ?"
+_SQL_UPDATE_TARGET = "UPDATE stocks SET last_notified_target = ? WHERE id = ?"
+
+@st.cache_resource
+def get_db_lock():
+    return threading.Lock()
+
 # Telegram bot setup
 # TELEGRAM_TOKEN = st.secrets.get("TELEGRAM_TOKEN", "your-telegram-bot-token")
 # CHAT_ID = st.secrets.get("CHAT_ID", "your-chat-id")
 # bot = telegram.Bot(token=TELEGRAM_TOKEN)
 TELEGRAM_TOKEN = st.secrets["TELEGRAM_TOKEN"]
 CHAT_ID = st.secrets["CHAT_ID"]
-bot = telegram.Bot(token=TELEGRAM_TOKEN)
+# Pooled so a cycle's messages reuse kept-alive connections
+bot = telegram.Bot(token=TELEGRAM_TOKEN, request=HTTPXRequest(connection_pool_size=8))
 
 # NSE headers
 headers = {
@@ -45,42 +88,110 @@ headers = {
     "Referer": "https://www.nseindia.com/market-data/equity-derivatives-watch",
 }
 
+# NSE's anti-bot cookies are saved after warmup and reused on restart while a probe quote
+# still succeeds, skipping the warmup's page loads and sleeps
+NSE_COOKIE_FILE = '.nse_cookies.json'
+NSE_COOKIE_PROBE_URL = "https://www.nseindia.com/api/quote-equity?symbol=SBIN"
+
+def load_nse_cookies(session):
+    try:
+        with open(NSE_COOKIE_FILE) as f:
+            session.cookies.update(json.load(f))
+    except (FileNotFoundError, ValueError):
+        return False
+    try:
+        return session.get(NSE_COOKIE_PROBE_URL, headers=headers).status_code == 200
+    except requests.RequestException:
+        return False
+
+def save_nse_cookies(session):
+    try:
+        with open(NSE_COOKIE_FILE, 'w') as f:
+            json.dump(requests.utils.dict_from_cookiejar(session.cookies), f)
+    except OSError as e:
+        st.warning(f"Could not save NSE cookies: {e}")
+
+# Warmed NSE session, built once per process; pooled connections are reused by every
+# price fetch and transient NSE failures are retried with backoff
+@st.cache_resource
+def get_nse_session():
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504])
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry))
+    if load_nse_cookies(session):
+        return session
+    session.cookies.clear()
+    response = session.get("https://www.nseindia.com/", headers=headers)
+    if response.status_code != 200:
+        raise RuntimeError(f"Failed to load NSE homepage: {response.status_code}")
+    time.sleep(2)
+    response = session.get("https://www.nseindia.com/market-data/equity-derivatives-watch", headers=headers)
+    time.sleep(2)
+    if response.status_code != 200:
+        raise RuntimeError(f"Failed to load NSE derivatives page: {response.status_code}")
+    save_nse_cookies(session)
+    return session
+
 # Initialize NSE session
 nse_session = None
 def initialize_nse_session():
     global nse_session
     if nse_session is None:
-        nse_session = requests.Session()
         try:
-            response = nse_session.get("https://www.nseindia.com/", headers=headers)
-            if response.status_code != 200:
-                st.warning(f"Failed to load NSE homepage: {response.status_code}")
-                return False
-            time.sleep(2)
-            response = nse_session.get("https://www.nseindia.com/market-data/equity-derivatives-watch", headers=headers)
-            time.sleep(2)
-            if response.status_code != 200:
-                st.warning(f"Failed to load NSE derivatives page: {response.status_code}")
-                return False
+            nse_session = get_nse_session()
         except Exception as e:
             st.error(f"Error initializing NSE session: {e}")
             return False
     return True
 
+@st.cache_resource
+def get_nse_lock():
+    return threading.Lock()
+
+# GET on the NSE session; expired cookies come back as 401/403, so the warmed session is
+# rebuilt once (unless another thread already replaced it) and the request retried
+def nse_get(url):
+    global nse_session
+    session = nse_session
+    response = session.get(url, headers=headers)
+    if response.status_code not in (401, 403):
+        return response
+    with get_nse_lock():
+        try:
+            if get_nse_session() is session:
+                get_nse_session.clear()
+            nse_session = get_nse_session()
+        except Exception as e:
+            st.error(f"Error initializing NSE session: {e}")
+            return response
+    return nse_session.get(url, headers=headers)
+
+# Live prices are reused for 30 s; cached as a resource so the cache outlives reruns
+@st.cache_resource
+def get_price_cache():
+    return TTLCache(30)
+
+def to_nse_symbol(symbol):
+    return symbol.upper().replace(".NS", "")
+
 # Function to fetch current price from NSE
 def get_current_price_nse(ticker):
     global nse_session
     try:
         # Strip .NS suffix for NSE API
-        ticker = ticker.upper().replace(".NS", "")
+        ticker = to_nse_symbol(ticker)
+        cached = get_price_cache().get(ticker)
+        if cached is not None:
+            return cached
         if nse_session is None and not initialize_nse_session():
             return None
         quote_url = f"https://www.nseindia.com/api/quote-equity?symbol={ticker}"
-        response = nse_session.get(quote_url, headers=headers)
+        response = nse_get(quote_url)
         if response.status_code == 200:
             quote_data = response.json()
             last_price = quote_data.get('priceInfo', {}).get('lastPrice', 0)
             if last_price > 0:
+                get_price_cache().set(ticker, last_price)
                 return last_price
             else:
                 st.warning(f"No valid price data for {ticker}")
@@ -92,6 +203,42 @@ def get_current_price_nse(ticker):
         st.warning(f"Error fetching NSE price for {ticker}: {e}")
         return None
 
+# Quotes for many symbols on a few threads; kept small since NSE throttles aggressive clients
+def get_prices_nse(symbols):
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols or (nse_session is None and not initialize_nse_session()):
+        return {}
+    with ThreadPoolExecutor(max_workers=5) as ex:
+        return dict(zip(symbols, ex.map(get_current_price_nse, symbols)))
+
+# Last prices for every NIFTY 500 stock in one request, keyed by NSE symbol
+NSE_SNAPSHOT_URL = "https://www.nseindia.com/api/equity-stockIndices?index=NIFTY%20500"
+
+def fetch_nse_snapshot():
+    try:
+        if nse_session is None and not initialize_nse_session():
+            return {}
+        response = nse_get(NSE_SNAPSHOT_URL)
+        if response.status_code != 200:
+            st.warning(f"Failed to fetch NSE snapshot: HTTP {response.status_code}")
+            return {}
+        return {item['symbol'].upper(): item['lastPrice'] for item in response.json().get('data', [])}
+    except Exception as e:
+        st.warning(f"Error fetching NSE snapshot: {e}")
+        return {}
+
+# Cached UI reads so widget reruns skip SQLite; cleared after every write
+@st.cache_data(ttl=30)
+def load_strategies():
+    return [row[0] for row in get_conn().execute("SELECT name FROM strategies")]
+
+# Plain tuples cache and pickle cheaply; the display wraps them as Stock rows
+Stock = namedtuple('Stock', ['id', 'symbol', 'alert_price', 'target_price', 'strategy', 'enabled'])
+
+@st.cache_data(ttl=15)
+def load_stocks():
+    return get_conn().execute("SELECT id, symbol, alert_price, target_price, strategy, enabled FROM stocks").fetchall()
+
 # Streamlit app
 st.title("Stock Alert System")
 
@@ -104,19 +251,15 @@ st.sidebar.subheader("Manage Strategies")
 new_strategy = st.sidebar.text_input("Add New Strategy")
 if st.sidebar.button("Add Strategy"):
     if new_strategy:
-        conn = sqlite3.connect('stock_alerts.db')
+        conn = get_conn()
         c = conn.cursor()
-        c.execute("INSERT INTO strategies (id, name) VALUES (?, ?)", (str(uuid.uuid4()), new_strategy))
-        conn.commit()
-        conn.close()
+        with get_db_lock():
+            c.execute("INSERT INTO strategies (id, name) VALUES (?, ?)", (str(uuid.uuid4()), new_strategy))
+        load_strategies.clear()
         st.sidebar.success(f"Strategy '{new_strategy}' added!")
 
 # Load strategies
-conn = sqlite3.connect('stock_alerts.db')
-c = conn.cursor()
-c.execute("SELECT name FROM strategies")
-strategies = [row[0] for row in c.fetchall()]
-conn.close()
+strategies = load_strategies()
 if not strategies:
     strategies = ["Buy", "Sell", "Hold"]
 
@@ -138,131 +281,193 @@ with st.form(key="add_stock_form"):
         # Validate symbol by checking if price data is available
         price = get_current_price_nse(symbol)
         if price is not None:
-            conn = sqlite3.connect('stock_alerts.db')
+            conn = get_conn()
             c = conn.cursor()
-            c.execute("INSERT INTO stocks (id, symbol, alert_price, target_price, strategy, enabled, last_notified_alert, last_notified_target) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                     (str(uuid.uuid4()), symbol.upper(), alert_price, target_price, strategy, 1, 0, 0))
-            conn.commit()
-            conn.close()
-            st.success(f"Added {symbol.upper()} to alerts!")
+            try:
+                with get_db_lock():
+                    c.execute("INSERT INTO stocks (id, symbol, alert_price, target_price, strategy, enabled, last_notified_alert, last_notified_target, nse_symbol) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (str(uuid.uuid4()), symbol.upper(), alert_price, target_price, strategy, 1, 0, 0, to_nse_symbol(symbol)))
+                load_stocks.clear()
+                st.success(f"Added {symbol.upper()} to alerts!")
+            except sqlite3.IntegrityError:
+                st.error(f"Stock {symbol.upper()} with strategy '{strategy}' already exists!")
         else:
             st.error(f"Invalid symbol {symbol.upper()}: No price data available")
 
 # Display and manage stocks
 st.subheader("Current Stock Alerts")
-conn = sqlite3.connect('stock_alerts.db')
-df = pd.read_sql_query("SELECT * FROM stocks", conn)
-conn.close()
+rows = [Stock(*r) for r in load_stocks()]
 
-if not df.empty:
-    for index, row in df.iterrows():
-        with st.expander(f"{row['symbol']} - {row['strategy']}"):
+if rows:
+    prices = get_prices_nse([row.symbol for row in rows])
+    for row in rows:
+        with st.expander(f"{row.symbol} - {row.strategy}"):
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                if st.button("Delete", key=f"delete_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
+                if st.button("Delete", key=f"delete_{row.id}"):
+                    conn = get_conn()
                     c = conn.cursor()
-                    c.execute("DELETE FROM stocks WHERE id = ?", (row['id'],))
-                    conn.commit()
-                    conn.close()
+                    with get_db_lock():
+                        c.execute("DELETE FROM stocks WHERE id = ?", (row.id,))
+                    load_stocks.clear()
                     st.experimental_rerun()
             with col2:
-                if st.button("Edit", key=f"edit_{row['id']}"):
-                    st.session_state[f"edit_mode_{row['id']}"] = True
+                if st.button("Edit", key=f"edit_{row.id}"):
+                    st.session_state[f"edit_mode_{row.id}"] = True
             with col3:
-                if st.button("Disable/Enable", key=f"toggle_{row['id']}"):
-                    conn = sqlite3.connect('stock_alerts.db')
+                if st.button("Disable/Enable", key=f"toggle_{row.id}"):
+                    conn = get_conn()
                     c = conn.cursor()
-                    new_status = 0 if row['enabled'] else 1
-                    c.execute("UPDATE stocks SET enabled = ? WHERE id = ?", (new_status, row['id']))
-                    conn.commit()
-                    conn.close()
+                    new_status = 0 if row.enabled else 1
+                    with get_db_lock():
+                        c.execute("UPDATE stocks SET enabled = ? WHERE id = ?", (new_status, row.id))
+                    load_stocks.clear()
                     st.experimental_rerun()
             with col4:
-                st.write(f"Enabled: {'Yes' if row['enabled'] else 'No'}")
+                st.write(f"Enabled: {'Yes' if row.enabled else 'No'}")
 
-            if st.session_state.get(f"edit_mode_{row['id']}", False):
-                with st.form(key=f"edit_form_{row['id']}"):
+            if st.session_state.get(f"edit_mode_{row.id}", False):
+                with st.form(key=f"edit_form_{row.id}"):
                     ecol1, ecol2, ecol3 = st.columns(3)
                     with ecol1:
-                        new_alert_price = st.number_input("New Alert Price", value=float(row['alert_price']), key=f"alert_{row['id']}")
+                        new_alert_price = st.number_input("New Alert Price", value=float(row.alert_price), key=f"alert_{row.id}")
                     with ecol2:
-                        new_target_price = st.number_input("New Target Price", value=float(row['target_price']), key=f"target_{row['id']}")
+                        new_target_price = st.number_input("New Target Price", value=float(row.target_price), key=f"target_{row.id}")
                     with ecol3:
-                        new_strategy = st.selectbox("New Strategy", strategies, index=strategies.index(row['strategy']), key=f"strat_{row['id']}")
+                        new_strategy = st.selectbox("New Strategy", strategies, index=strategies.index(row.strategy), key=f"strat_{row.id}")
                     if st.form_submit_button("Save Changes"):
-                        conn = sqlite3.connect('stock_alerts.db')
+                        conn = get_conn()
                         c = conn.cursor()
-                        c.execute("UPDATE stocks SET alert_price = ?, target_price = ?, strategy = ? WHERE id = ?",
-                                 (new_alert_price, new_target_price, new_strategy, row['id']))
-                        conn.commit()
-                        conn.close()
-                        st.session_state[f"edit_mode_{row['id']}"] = False
-                        st.experimental_rerun()
-
-            st.write(f"Alert Price: ₹{row['alert_price']:.2f}")
-            st.write(f"Target Price: ₹{row['target_price']:.2f}")
-            current_price = get_current_price_nse(row['symbol'])
+                        try:
+                            with get_db_lock():
+                                c.execute("UPDATE stocks SET alert_price = ?, target_price = ?, strategy = ? WHERE id = ?",
+                                         (new_alert_price, new_target_price, new_strategy, row.id))
+                            load_stocks.clear()
+                            st.session_state[f"edit_mode_{row.id}"] = False
+                            st.experimental_rerun()
+                        except sqlite3.IntegrityError:
+                            st.error(f"Cannot update: Stock {row.symbol} with strategy '{new_strategy}' already exists!")
+
+            st.write(f"Alert Price: ₹{row.alert_price:.2f}")
+            st.write(f"Target Price: ₹{row.target_price:.2f}")
+            current_price = prices.get(row.symbol)
             if current_price:
                 st.write(f"Current Price: ₹{current_price:.2f}")
             else:
                 st.write("Current Price: Unavailable")
 
 # Price checking and notification logic
+# Telegram allows about one message per second to a chat; short bursts of three are fine
+@st.cache_resource
+def get_send_bucket():
+    return TokenBucket(rate=1, capacity=3)
+
 async def send_telegram_message(message):
-    try:
-        await bot.send_message(chat_id=CHAT_ID, text=message)
-    except Exception as e:
-        st.error(f"Failed to send Telegram message: {e}")
+    while True:
+        await get_send_bucket().acquire()
+        try:
+            await bot.send_message(chat_id=CHAT_ID, text=message)
+            return
+        except telegram.error.RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            st.error(f"Failed to send Telegram message: {e}")
+            return
+
+# One long-lived event loop for Telegram, instead of a fresh loop and TLS session per message
+@st.cache_resource
+def get_telegram_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+async def send_telegram_messages(messages):
+    await asyncio.gather(*(send_telegram_message(message) for message in messages))
+
+# Join a cycle's alerts into as few messages as fit Telegram's length limit,
+# splitting only between alerts
+TELEGRAM_MAX_LENGTH = 4096
+
+def batch_messages(messages):
+    batches, current = [], ""
+    for message in messages:
+        candidate = f"{current}\n{message}" if current else message
+        if len(candidate) <= TELEGRAM_MAX_LENGTH:
+            current = candidate
+        else:
+            if current:
+                batches.append(current)
+            current = message[:TELEGRAM_MAX_LENGTH]
+    if current:
+        batches.append(current)
+    return batches
+
+def send_all(messages):
+    if messages:
+        asyncio.run_coroutine_threadsafe(send_telegram_messages(batch_messages(messages)), get_telegram_loop())
 
 def check_prices():
-    conn = sqlite3.connect('stock_alerts.db')
-    df = pd.read_sql_query("SELECT * FROM stocks WHERE enabled = 1", conn)
-    conn.close()
+    conn = get_conn()
+    df = pd.read_sql_query(_SQL_ENABLED_STOCKS, conn)
 
-    for _, row in df.iterrows():
-        try:
-            current_price = get_current_price_nse(row['symbol'])
-            if current_price is None:
-                continue
-            current_time = time.time()
-
-            # Check alert price
-            if (row['alert_price'] > 0 and 
-                ((current_price <= row['alert_price'] and current_price < row['last_notified_alert']) or 
-                 (current_price >= row['alert_price'] and current_price > row['last_notified_alert']))):
-                message = f"🚨 Alert: {row['symbol']} hit alert price ₹{row['alert_price']:.2f}! Current: ₹{current_price:.2f}"
-                asyncio.run(send_telegram_message(message))
-                conn = sqlite3.connect('stock_alerts.db')
-                c = conn.cursor()
-                c.execute("UPDATE stocks SET last_notified_alert = ? WHERE id = ?", (current_price, row['id']))
-                conn.commit()
-                conn.close()
-
-            # Check target price
-            if (row['target_price'] > 0 and 
-                ((current_price <= row['target_price'] and current_price < row['last_notified_target']) or 
-                 (current_price >= row['target_price'] and current_price > row['last_notified_target']))):
-                message = f"🎯 Target: {row['symbol']} hit target price ₹{row['target_price']:.2f}! Current: ₹{current_price:.2f}"
-                asyncio.run(send_telegram_message(message))
-                conn = sqlite3.connect('stock_alerts.db')
-                c = conn.cursor()
-                c.execute("UPDATE stocks SET last_notified_target = ? WHERE id = ?", (current_price, row['id']))
-                conn.commit()
-                conn.close()
+    # One snapshot per cycle; symbols outside it are quoted individually, in parallel
+    snapshot = fetch_nse_snapshot()
+    fallback = get_prices_nse(df.loc[~df['nse_symbol'].isin(list(snapshot)), 'nse_symbol'].tolist())
+    df['current_price'] = df['nse_symbol'].map(snapshot).fillna(df['nse_symbol'].map(fallback)).astype(float)
 
-        except Exception as e:
-            st.error(f"Error checking {row['symbol']}: {e}")
+    # Alert and target are the same crossing test, so run it once over both columns;
+    # NaN prices and notified values never match
+    price = df['current_price'].to_numpy()[:, None]
+    levels = df[['alert_price', 'target_price']].to_numpy(dtype=float)
+    notified = df[['last_notified_alert', 'last_notified_target']].to_numpy(dtype=float)
+    hits = (levels > 0) & (((price <= levels) & (price < notified)) | ((price >= levels) & (price > notified)))
+    alert_hits = df[hits[:, 0]]
+    target_hits = df[hits[:, 1]]
+
+    messages = [f"🚨 Alert: {row.symbol} hit alert price ₹{row.alert_price:.2f}! Current: ₹{row.current_price:.2f}"
+                for row in alert_hits.itertuples(index=False, name='Stock')]
+    messages += [f"🎯 Target: {row.symbol} hit target price ₹{row.target_price:.2f}! Current: ₹{row.current_price:.2f}"
+                 for row in target_hits.itertuples(index=False, name='Stock')]
+    alert_updates = list(zip(alert_hits['current_price'].tolist(), alert_hits['id']))
+    target_updates = list(zip(target_hits['current_price'].tolist(), target_hits['id']))
+
+    # Save this cycle's notified prices in one transaction, then send
+    if alert_updates or target_updates:
+        with get_db_lock():
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(_SQL_UPDATE_ALERT, alert_updates)
+                conn.executemany(_SQL_UPDATE_TARGET, target_updates)
+                conn.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                logging.error(f"Failed to save notified prices: {e}")
+                return
+    send_all(messages)
 
 # Schedule price checks
 def run_scheduler():
-    schedule.every(check_interval).minutes.do(check_prices)
+    # Every check_interval minutes from a monotonic deadline
+    interval = check_interval * 60
+    deadline = time.monotonic()
     while True:
-        schedule.run_pending()
-        time.sleep(60)
+        # Log and keep going; this thread is the only scheduler in the process
+        try:
+            check_prices()
+        except Exception:
+            logging.exception("Price check failed")
+        deadline += interval
+        if deadline < time.monotonic():
+            deadline = time.monotonic()
+        time.sleep(max(0, deadline - time.monotonic()))
 
-# Start scheduler in background thread
-if 'scheduler_thread' not in st.session_state:
-    st.session_state.scheduler_thread = True
+# Start the scheduler thread once per process; session_state is per browser session,
+# so every new tab used to start another scheduler
+@st.cache_resource
+def get_scheduler():
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
\ No newline at end of file
+    scheduler_thread.start()
+    return scheduler_thread
+
+get_scheduler()
\ No newline at end of file
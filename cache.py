@@ -0,0 +1,20 @@
+import threading
+import time
+
+# Small thread-safe cache whose entries expire ttl seconds after they are set
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.d = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.d.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.d[key] = (time.monotonic(), value)
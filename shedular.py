@@ -1,16 +1,19 @@
 import sqlite3
 import pandas as pd
+import numpy as np
 import yfinance as yf
 import asyncio
 import telegram
+from telegram.request import HTTPXRequest
 import time
-import schedule
 import threading
 import uuid
 from datetime import datetime
 import pytz
 import logging
 import json
+from cache import TTLCache
+from ratelimit import TokenBucket
 
 # Configure logging
 logging.basicConfig(
@@ -22,101 +25,227 @@ logging.basicConfig(
 # Set timezone to IST
 ist = pytz.timezone('Asia/Kolkata')
 
-# Database setup
+# One autocommit connection shared by add_stock and the scheduler thread; WAL keeps readers
+# off the writer's lock, and _lock serialises the writers
+_DB = sqlite3.connect('stock_alerts.db', check_same_thread=False, isolation_level=None, cached_statements=256)
+_DB.execute('PRAGMA journal_mode=WAL')
+_DB.execute('PRAGMA synchronous=NORMAL')
+_DB.execute('PRAGMA temp_store=MEMORY')
+_DB.execute('PRAGMA cache_size=-64000')
+_lock = threading.Lock()
+
+# Database setup; migrations run once per schema version, tracked in PRAGMA user_version
+SCHEMA_VERSION = 2
+
 def init_db():
-    conn = sqlite3.connect('stock_alerts.db')
-    c = conn.cursor()
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS stocks
-                 (id TEXT PRIMARY KEY, 
-                  symbol TEXT, 
-                  initial_price REAL, 
-                  alert_price REAL, 
-                  target_price REAL, 
-                  strategy TEXT, 
-                  enabled INTEGER, 
-                  created_at INTEGER, 
-                  alert_triggered INTEGER DEFAULT 0, 
-                  last_notified_alert INTEGER DEFAULT 0, 
-                  last_notified_target INTEGER DEFAULT 0,
-                  notification_cooldown INTEGER DEFAULT 600)''')
-    
-    c.execute("PRAGMA table_info(stocks)")
-    columns = [info[1] for info in c.fetchall()]
-    
-    for column, column_type, default in [
-        ('initial_price', 'REAL', '0'),
-        ('created_at', 'INTEGER', '0'),
-        ('alert_triggered', 'INTEGER', '0'),
-        ('last_notified_alert', 'INTEGER', '0'),
-        ('last_notified_target', 'INTEGER', '0'),
-        ('notification_cooldown', 'INTEGER', '600')
-    ]:
-        if column not in columns:
-            c.execute(f"ALTER TABLE stocks ADD COLUMN {column} {column_type} DEFAULT {default}")
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS strategies
-                 (id TEXT PRIMARY KEY, name TEXT)''')
-    
-    c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_symbol_strategy ON stocks (symbol, strategy)''')
-    
-    conn.commit()
-    conn.close()
+    with _lock:
+        if _DB.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        _DB.execute("BEGIN IMMEDIATE")
+        try:
+            _DB.execute('''CREATE TABLE IF NOT EXISTS stocks
+                           (id TEXT PRIMARY KEY, 
+                            symbol TEXT, 
+                            initial_price REAL, 
+                            alert_price REAL, 
+                            target_price REAL, 
+                            strategy TEXT, 
+                            enabled INTEGER, 
+                            created_at INTEGER, 
+                            alert_triggered INTEGER DEFAULT 0, 
+                            last_notified_alert INTEGER DEFAULT 0, 
+                            last_notified_target INTEGER DEFAULT 0,
+                            notification_cooldown INTEGER DEFAULT 600)''')
+            
+            columns = [info[1] for info in _DB.execute("PRAGMA table_info(stocks)")]
+            for column, column_type, default in [
+                ('initial_price', 'REAL', '0'),
+                ('created_at', 'INTEGER', '0'),
+                ('alert_triggered', 'INTEGER', '0'),
+                ('last_notified_alert', 'INTEGER', '0'),
+                ('last_notified_target', 'INTEGER', '0'),
+                ('notification_cooldown', 'INTEGER', '600')
+            ]:
+                if column not in columns:
+                    _DB.execute(f"ALTER TABLE stocks ADD COLUMN {column} {column_type} DEFAULT {default}")
+            
+            _DB.execute('''CREATE TABLE IF NOT EXISTS strategies
+                           (id TEXT PRIMARY KEY, name TEXT)''')
+            
+            _DB.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_symbol_strategy ON stocks (symbol, strategy)''')
+            # Partial index over the enabled rows check_prices scans, covering every column it reads (v2)
+            _DB.execute('''CREATE INDEX IF NOT EXISTS idx_stocks_v20_cover ON stocks
+                           (enabled, id, symbol, alert_price, target_price, alert_triggered, last_notified_alert,
+                            last_notified_target, notification_cooldown, created_at)
+                           WHERE enabled = 1''')
+            
+            _DB.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            _DB.execute("COMMIT")
+        except Exception:
+            _DB.execute("ROLLBACK")
+            raise
 
 # Initialize database
 init_db()
 
+# Hot-path SQL kept as constants so each run reuses the compiled statement from the cache
+_SQL_ENABLED_STOCKS = ("SELECT id, symbol, alert_price, target_price, alert_triggered, last_notified_alert, "
+                       "last_notified_target, notification_cooldown, created_at FROM stocks WHERE enabled = 1")
+_SQL_UPDATE_ALERT = "UPDATE stocks SET alert_triggered = 1, last_notified_alert = ? WHERE id = ?"
+_SQL_UPDATE_TARGET = "UPDATE stocks SET last_notified_target = ? WHERE id = ?"
+
 # Telegram bot setup
 TELEGRAM_TOKEN = "YOUR_TELEGRAM_TOKEN"  # Replace with your actual Telegram bot token
 CHAT_ID = "YOUR_CHAT_ID"  # Replace with your actual Telegram chat ID
-bot = telegram.Bot(token=TELEGRAM_TOKEN)
+# Pooled so a cycle's messages reuse kept-alive connections
+bot = telegram.Bot(token=TELEGRAM_TOKEN, request=HTTPXRequest(connection_pool_size=8))
 
 # Price checking and notification logic
+# Telegram allows about one message per second to a chat; short bursts of three are fine
+_bucket = TokenBucket(rate=1, capacity=3)
+
 async def send_telegram_message(message):
+    while True:
+        await _bucket.acquire()
+        try:
+            await bot.send_message(chat_id=CHAT_ID, text=message)
+            logging.info(f"Sent Telegram message: {message}")
+            return
+        except telegram.error.RetryAfter as e:
+            logging.warning(f"Telegram rate limit hit, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logging.error(f"Failed to send Telegram message: {e}")
+            return
+
+# One long-lived event loop for Telegram, instead of a fresh loop and TLS session per message
+_loop = asyncio.new_event_loop()
+threading.Thread(target=_loop.run_forever, daemon=True).start()
+
+async def send_telegram_messages(messages):
+    await asyncio.gather(*(send_telegram_message(message) for message in messages))
+
+# Join a cycle's alerts into as few messages as fit Telegram's length limit,
+# splitting only between alerts
+TELEGRAM_MAX_LENGTH = 4096
+
+def batch_messages(messages):
+    batches, current = [], ""
+    for message in messages:
+        candidate = f"{current}\n{message}" if current else message
+        if len(candidate) <= TELEGRAM_MAX_LENGTH:
+            current = candidate
+        else:
+            if current:
+                batches.append(current)
+            current = message[:TELEGRAM_MAX_LENGTH]
+    if current:
+        batches.append(current)
+    return batches
+
+def send_all(messages):
+    if messages:
+        asyncio.run_coroutine_threadsafe(send_telegram_messages(batch_messages(messages)), _loop)
+
+# Live prices are reused for 30 s; the V20 range comes from daily history and is reused for a day
+_price_cache = TTLCache(30)
+_v20_cache = TTLCache(86400)
+
+def to_ticker(symbol):
+    return symbol.upper() if symbol.endswith('.NS') else f"{symbol.upper()}.NS"
+
+def _get_current_price(symbol):
+    ticker = to_ticker(symbol)
+    current_price = _price_cache.get(ticker)
+    if current_price is None:
+        info = yf.Ticker(ticker).info
+        current_price = info.get('regularMarketPrice', None)
+        if current_price is None:
+            logging.warning(f"No valid current price for {symbol}. Response: {info}")
+            return None
+        _price_cache.set(ticker, current_price)
+    return current_price
+
+# One chart request gives both the latest close and the candles for the V20 scan
+def _download_history(ticker):
+    hist = yf.download(ticker, period="1y2mo", interval="1d", progress=False, threads=False, auto_adjust=True)
+    if isinstance(hist.columns, pd.MultiIndex):
+        hist.columns = hist.columns.get_level_values(0)
+    return hist
+
+def _find_v20_range(hist):
+    # ok[i, j]: green candle i gains 20% over the low of an earlier candle j with no red candle after j;
+    # the latest such i, then the latest j for it, is the most recent V20 range
+    o, h, l, c = hist[['Open', 'High', 'Low', 'Close']].to_numpy().T
+    idx = np.arange(len(c))
+    last_red = np.maximum.accumulate(np.where(c < o, idx, -1))
+    prev_red = np.concatenate(([-1], last_red[:-1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain_percent = (h[:, None] - l[None, :]) / l[None, :] * 100
+    ok = ((gain_percent >= 20) & (c > o)[:, None] &
+          (idx[None, :] < idx[:, None]) & (idx[None, :] >= prev_red[:, None]))
+    green_ends = np.flatnonzero(ok.any(axis=1))
+    if not green_ends.size:
+        return None
+    i = green_ends[-1]
+    j = np.flatnonzero(ok[i])[-1]
+    return (l[j], h[i])
+
+def get_current_price(symbol):
     try:
-        await bot.send_message(chat_id=CHAT_ID, text=message)
-        logging.info(f"Sent Telegram message: {message}")
+        return _get_current_price(symbol)
+    except json.JSONDecodeError as e:
+        logging.error(f"JSON decode error for {symbol}: {e}")
+        return None
     except Exception as e:
-        logging.error(f"Failed to send Telegram message: {e}")
+        logging.error(f"Error fetching data for {symbol}: {e}")
+        return None
+
+# Latest 1-minute close for every symbol from one batched download; cached prices are reused
+# and anything the batch misses falls back to a single quote
+def get_current_prices(symbols):
+    tickers = {symbol: to_ticker(symbol) for symbol in symbols}
+    missing = sorted({ticker for ticker in tickers.values() if _price_cache.get(ticker) is None})
+    if missing:
+        try:
+            data = yf.download(missing, period="1d", interval="1m", group_by='ticker', threads=True, progress=False)
+            for ticker in missing:
+                try:
+                    closes = (data[ticker] if isinstance(data.columns, pd.MultiIndex) else data)['Close'].dropna()
+                except KeyError:
+                    continue
+                if not closes.empty:
+                    _price_cache.set(ticker, float(closes.iloc[-1]))
+        except Exception as e:
+            logging.error(f"Batch price download failed for {len(missing)} symbols: {e}")
+    # Keyed by ticker so symbols spelled differently share one fallback quote
+    prices = {ticker: _price_cache.get(ticker) for ticker in set(tickers.values())}
+    for ticker, price in prices.items():
+        if price is None:
+            prices[ticker] = get_current_price(ticker)
+    return {symbol: prices[ticker] for symbol, ticker in tickers.items()}
 
 def get_stock_data(symbol):
     try:
-        ticker = symbol.upper() if symbol.endswith('.NS') else f"{symbol.upper()}.NS"
-        stock = yf.Ticker(ticker)
-        
-        info = stock.info
-        current_price = info.get('regularMarketPrice', None)
-        if current_price is None:
-            logging.warning(f"No valid current price for {symbol}. Response: {info}")
-            return None, None
-        
-        hist = stock.history(period="1y2mo", interval="1d")
-        if hist.empty:
-            logging.warning(f"No historical data for {symbol}")
-            return current_price, None
-        
-        v20_range = None
-        for i in range(len(hist) - 1, -1, -1):
-            current_candle = hist.iloc[i]
-            if current_candle['Close'] > current_candle['Open']:
-                for j in range(i - 1, -1, -1):
-                    prev_candle = hist.iloc[j]
-                    gain_percent = ((current_candle['High'] - prev_candle['Low']) / prev_candle['Low']) * 100
-                    if gain_percent >= 20:
-                        momentum_broken = False
-                        for k in range(j + 1, i + 1):
-                            if hist.iloc[k]['Close'] < hist.iloc[k]['Open']:
-                                momentum_broken = True
-                                break
-                        if not momentum_broken:
-                            v20_range = (prev_candle['Low'], current_candle['High'])
-                            break
-                if v20_range:
-                    break
-        
-        if not v20_range:
-            logging.warning(f"No V20 range found for {symbol}")
-            return current_price, None
+        ticker = to_ticker(symbol)
+        # A cached V20 range only needs the live price; the history download runs on a miss
+        v20_range = _v20_cache.get(ticker)
+        if v20_range is not None:
+            current_price = get_current_prices([symbol])[symbol]
+            if current_price is None:
+                return None, None
+        else:
+            hist = _download_history(ticker)
+            if hist.empty:
+                logging.warning(f"No historical data for {symbol}")
+                return None, None
+            current_price = float(hist['Close'].iloc[-1])
+            _price_cache.set(ticker, current_price)
+            v20_range = _find_v20_range(hist)
+            if not v20_range:
+                logging.warning(f"No V20 range found for {symbol}")
+                return current_price, None
+            _v20_cache.set(ticker, v20_range)
         
         logging.info(f"Fetched data for {symbol}: Current price ₹{current_price:.2f}, V20 range low ₹{v20_range[0]:.2f}, high ₹{v20_range[1]:.2f}")
         return current_price, v20_range
@@ -129,83 +258,94 @@ def get_stock_data(symbol):
         return None, None
 
 def add_stock(symbol, strategy="V20"):
-    conn = sqlite3.connect('stock_alerts.db')
-    c = conn.cursor()
-    c.execute("SELECT id FROM stocks WHERE symbol = ? AND strategy = ?", (symbol.upper(), strategy))
-    existing_stock = c.fetchone()
+    existing_stock = _DB.execute("SELECT id FROM stocks WHERE symbol = ? AND strategy = ?", (symbol.upper(), strategy)).fetchone()
     
     if existing_stock:
         logging.warning(f"Attempted to add duplicate stock {symbol.upper()} with strategy {strategy}")
-        conn.close()
         return
     
     current_price, v20_range = get_stock_data(symbol)
     if current_price is not None and v20_range:
         alert_price, target_price = v20_range
         created_at = int(time.time())
-        c.execute("""INSERT INTO stocks 
-                     (id, symbol, initial_price, alert_price, target_price, strategy, enabled, created_at, 
-                     alert_triggered, last_notified_alert, last_notified_target, notification_cooldown) 
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                 (str(uuid.uuid4()), symbol.upper(), current_price, alert_price, target_price, strategy, 1, 
-                  created_at, 0, 0, 0, 600))
-        conn.commit()
+        with _lock:
+            _DB.execute("""INSERT INTO stocks 
+                           (id, symbol, initial_price, alert_price, target_price, strategy, enabled, created_at, 
+                           alert_triggered, last_notified_alert, last_notified_target, notification_cooldown) 
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        (str(uuid.uuid4()), symbol.upper(), current_price, alert_price, target_price, strategy, 1, 
+                         created_at, 0, 0, 0, 600))
         logging.info(f"Added stock {symbol.upper()} with initial price ₹{current_price:.2f}, alert price ₹{alert_price:.2f}, target price ₹{target_price:.2f}, strategy {strategy}")
     else:
         logging.error(f"Failed to add stock {symbol.upper()}: No V20 range data")
-    conn.close()
 
 def check_prices():
-    conn = sqlite3.connect('stock_alerts.db')
-    df = pd.read_sql_query("SELECT * FROM stocks WHERE enabled = 1", conn)
-    conn.close()
+    df = pd.read_sql_query(_SQL_ENABLED_STOCKS, _DB)
 
     current_time = time.time()
+    prices = get_current_prices(list(dict.fromkeys(df['symbol'])))
+    df['current_price'] = df['symbol'].map(prices).astype(float)
 
-    for _, row in df.iterrows():
-        try:
-            current_price, _ = get_stock_data(row['symbol'])
-            if current_price is None:
-                continue
+    # Compare the whole frame at once; rows without a price never match
+    price = df['current_price']
+    untriggered = df['alert_triggered'] == 0
+    # Freshly added stocks already at the alert price don't notify
+    just_added = (untriggered & (current_time - df['created_at'] < 60) &
+                  ((price - df['alert_price']).abs() / df['alert_price'] <= 0.01))
+    for symbol in df.loc[just_added, 'symbol']:
+        logging.info(f"Skipping initial alert notification for {symbol} as price is already at/beyond V20 alert price")
 
-            if current_time - row['created_at'] < 60 and row['alert_triggered'] == 0:
-                if abs(current_price - row['alert_price']) / row['alert_price'] <= 0.01:
-                    logging.info(f"Skipping initial alert notification for {row['symbol']} as price is already at/beyond V20 alert price")
-                    continue
+    # Cooldown and level checks for alert and target in one pass over both columns
+    notified = df[['last_notified_alert', 'last_notified_target']].to_numpy(dtype=float)
+    last_sent = np.where(notified > 0, notified, df['created_at'].to_numpy(dtype=float)[:, None])
+    cooled = current_time - last_sent >= df['notification_cooldown'].to_numpy(dtype=float)[:, None]
+    levels = df[['alert_price', 'target_price']].to_numpy(dtype=float)
+    p = price.to_numpy()
+    # Alerts fire at or below the buy price before the alert triggers, targets at or above after
+    armed = np.column_stack((untriggered & ~just_added, df['alert_triggered'] == 1))
+    reached = np.column_stack((p <= levels[:, 0] + 0.01, p >= levels[:, 1] - 0.01))
+    hits = (levels > 0) & cooled & armed & reached
+    alerts = df[hits[:, 0]]
+    targets = df[hits[:, 1]]
 
-            if row['alert_price'] > 0 and row['alert_triggered'] == 0:
-                last_alert_time = row['last_notified_alert'] if row['last_notified_alert'] > 0 else row['created_at']
-                if current_time - last_alert_time >= row['notification_cooldown'] and current_price <= row['alert_price'] + 0.01:
-                    message = f"🚨 V20 Buy Alert: {row['symbol']} hit buy price ₹{row['alert_price']:.2f}! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    c.execute("UPDATE stocks SET alert_triggered = 1, last_notified_alert = ? WHERE id = ?", (current_time, row['id']))
-                    conn.commit()
-                    conn.close()
-                    logging.info(f"Buy alert triggered for {row['symbol']} at ₹{current_price:.2f}")
-
-            if row['target_price'] > 0 and row['alert_triggered'] == 1:
-                last_target_time = row['last_notified_target'] if row['last_notified_target'] > 0 else row['created_at']
-                if current_time - last_target_time >= row['notification_cooldown'] and current_price >= row['target_price'] - 0.01:
-                    message = f"🎯 V20 Sell Alert: {row['symbol']} hit target price ₹{row['target_price']:.2f}! Current: ₹{current_price:.2f}"
-                    asyncio.run(send_telegram_message(message))
-                    conn = sqlite3.connect('stock_alerts.db')
-                    c = conn.cursor()
-                    c.execute("UPDATE stocks SET last_notified_target = ? WHERE id = ?", (current_time, row['id']))
-                    conn.commit()
-                    conn.close()
-                    logging.info(f"Sell alert triggered for {row['symbol']} at ₹{current_price:.2f}")
+    messages = []
+    for row in alerts.itertuples(index=False, name='Stock'):
+        messages.append(f"🚨 V20 Buy Alert: {row.symbol} hit buy price ₹{row.alert_price:.2f}! Current: ₹{row.current_price:.2f}")
+        logging.info(f"Buy alert triggered for {row.symbol} at ₹{row.current_price:.2f}")
+    for row in targets.itertuples(index=False, name='Stock'):
+        messages.append(f"🎯 V20 Sell Alert: {row.symbol} hit target price ₹{row.target_price:.2f}! Current: ₹{row.current_price:.2f}")
+        logging.info(f"Sell alert triggered for {row.symbol} at ₹{row.current_price:.2f}")
+    alert_updates = [(current_time, stock_id) for stock_id in alerts['id']]
+    target_updates = [(current_time, stock_id) for stock_id in targets['id']]
 
-        except Exception as e:
-            logging.error(f"Error checking {row['symbol']}: {e}")
+    # Save this cycle's notification state in one transaction, then send
+    if alert_updates or target_updates:
+        with _lock:
+            _DB.execute("BEGIN IMMEDIATE")
+            try:
+                _DB.executemany(_SQL_UPDATE_ALERT, alert_updates)
+                _DB.executemany(_SQL_UPDATE_TARGET, target_updates)
+                _DB.execute("COMMIT")
+            except Exception as e:
+                _DB.execute("ROLLBACK")
+                logging.error(f"Failed to save notification state: {e}")
+                return
+    send_all(messages)
 
 # Schedule price checks
 def run_scheduler():
-    schedule.every(5).minutes.do(check_prices)  # Check every 5 minutes (adjust as needed)
+    # Monotonic deadline; a late tick resets it rather than catching up
+    interval = 5 * 60  # Check every 5 minutes (adjust as needed)
+    deadline = time.monotonic()
     while True:
-        schedule.run_pending()
-        time.sleep(60)
+        try:
+            check_prices()
+        except Exception:
+            logging.exception("Price check failed; monitoring continues")
+        deadline += interval
+        if deadline < time.monotonic():
+            deadline = time.monotonic()
+        time.sleep(max(0, deadline - time.monotonic()))
 
 # Start scheduler in background thread
 if __name__ == "__main__":